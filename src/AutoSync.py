@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+from datetime import timedelta
+import subprocess
+import numpy as np
+import LogParser
+
+# samples per second at which the footage and the log are compared
+sync_rate = 10
+
+# (width, height) of the frames the motion of the footage is measured on
+motion_size = (64, 36)
+
+# frames of the footage read from ffmpeg at once
+motion_chunk = 1000
+
+# fraction of the shorter of footage and log that must overlap the other for an offset to be considered. Short
+# overlaps correlate well by chance, so the footage is expected to lie mostly within the log or the other way around
+min_overlap_fraction = 0.75
+
+
+def motion_energy(footage_path, rate=sync_rate, size=motion_size):
+    """
+    Measures how much the picture changes over time as the mean absolute difference between consecutive frames, one
+    value every 1 / rate seconds. ffmpeg decodes the footage skipping the loop filter and non-reference frames and
+    hands it over tiny and grey, so a long file is read in seconds
+    """
+    from moviepy.config import get_setting
+    command = [get_setting('FFMPEG_BINARY'), '-loglevel', 'error',
+               '-skip_loop_filter', 'all', '-skip_frame', 'noref', '-i', footage_path,
+               '-vf', 'fps={},scale={}:{}'.format(rate, size[0], size[1]), '-an',
+               '-f', 'rawvideo', '-pix_fmt', 'gray', 'pipe:1']
+    process = subprocess.Popen(command, stdout=subprocess.PIPE)
+
+    frame_bytes = size[0] * size[1]
+    energy = []
+    previous = None
+    while True:
+        raw = process.stdout.read(frame_bytes * motion_chunk)
+        n_frames = len(raw) // frame_bytes
+        if n_frames == 0:
+            break
+        frames = np.frombuffer(raw[:n_frames * frame_bytes], dtype=np.uint8).reshape(n_frames, frame_bytes)
+        frames = frames.astype(np.int16)
+        if previous is not None:
+            frames = np.concatenate([previous, frames])
+        energy.append(np.abs(np.diff(frames, axis=0)).mean(axis=1))
+        previous = frames[-1:]
+
+    process.stdout.close()
+    if process.wait() != 0:
+        raise Exception('ffmpeg failed with exit code {}'.format(process.returncode))
+    if not energy:
+        return np.zeros(0)
+    energy = np.concatenate(energy)
+    # the first frame has nothing to be compared with
+    return np.concatenate([energy[:1], energy])
+
+
+def log_activity(data, rate=sync_rate):
+    """
+    Resamples the speed and pitch of a LogColumns every 1 / rate seconds and combines them into a single signal of how
+    much the board is moving: the standardized speed plus the standardized rate of change of pitch. Returns the time
+    of the first sample, in microseconds since the unix epoch, and the signal
+    """
+    times = np.arange(data.time[0], data.time[-1], 1e6 / rate)
+    speed = interpolate(times, data.time, data.speed)
+    pitch = interpolate(times, data.time, data.pitch)
+    return data.time[0], standardize(speed) + standardize(np.abs(np.gradient(pitch)))
+
+
+def interpolate(times, log_times, values):
+    valid = ~np.isnan(values)
+    if not valid.any():
+        return np.zeros(len(times))
+    return np.interp(times, log_times[valid], values[valid])
+
+
+def standardize(signal):
+    std = signal.std()
+    if std == 0:
+        return np.zeros(len(signal))
+    return (signal - signal.mean()) / std
+
+
+def cross_correlate(signal, reference, min_overlap):
+    """
+    Computes the Pearson correlation between signal and reference for every lag at which signal, starting lag samples
+    into reference, overlaps it by at least min_overlap samples. The sums over each overlap are all obtained at once
+    from FFTs. Returns the lags and their correlations
+    """
+    n_signal = len(signal)
+    n_reference = len(reference)
+    size = 1 << (n_signal + n_reference - 2).bit_length()
+
+    def correlate(a, b):
+        # sum of a[i] * b[i + lag] for every lag, negative lags wrapping around to the end
+        sums = np.fft.irfft(np.fft.rfft(b, size) * np.conj(np.fft.rfft(a, size)), size)
+        return np.concatenate([sums[size - (n_signal - 1):], sums[:n_reference]])
+
+    lags = np.arange(-(n_signal - 1), n_reference)
+    overlap = np.minimum(lags + n_signal, n_reference) - np.maximum(lags, 0)
+    valid = overlap >= min_overlap
+    ones_signal = np.ones(n_signal)
+    ones_reference = np.ones(n_reference)
+    n = overlap[valid].astype(np.float64)
+    sum_signal = correlate(signal, ones_reference)[valid]
+    sum_reference = correlate(ones_signal, reference)[valid]
+    sum_signal_2 = correlate(signal ** 2, ones_reference)[valid]
+    sum_reference_2 = correlate(ones_signal, reference ** 2)[valid]
+    sum_product = correlate(signal, reference)[valid]
+
+    covariance = sum_product - sum_signal * sum_reference / n
+    variance = (sum_signal_2 - sum_signal ** 2 / n) * (sum_reference_2 - sum_reference ** 2 / n)
+    return lags[valid], covariance / np.sqrt(np.maximum(variance, 1e-12))
+
+
+def find_start_date(log_path, footage_path, unit, start_second=0, rate=sync_rate):
+    """
+    Proposes the start date of the frame at start_second by finding where the motion of the footage best matches the
+    activity in the log. Returns a dictionary with the 'start_date', the 'offset' in seconds of the start of the
+    footage from the start of the log, the 'correlation' found there and a 'confidence' between 0 and 1 that drops as
+    other offsets match almost as well as the best one
+    """
+    data = LogParser.parse_columns(log_path, unit)
+    log_start, activity = log_activity(data, rate)
+    print 'Measuring the motion of', footage_path, '...'
+    motion = standardize(motion_energy(footage_path, rate))
+
+    min_overlap = max(int(min(len(motion), len(activity)) * min_overlap_fraction), 2)
+    lags, scores = cross_correlate(motion, activity, min_overlap)
+    if len(scores) == 0:
+        raise Exception('The footage and the log are too short to be synced')
+
+    # the confidence compares the best peak with the best score outside of it, both measured above the typical score.
+    # The peak spans the lags around the best one that score above the typical score
+    best = np.argmax(scores)
+    baseline = np.median(scores)
+    below = np.nonzero(scores <= baseline)[0]
+    peak_start = below[below < best].max() if (below < best).any() else 0
+    peak_end = below[below > best].min() if (below > best).any() else len(scores)
+    rivals = np.concatenate([scores[:peak_start], scores[peak_end:]])
+    runner_up = max(rivals.max() - baseline, 0.0) if len(rivals) else 0.0
+    peak = scores[best] - baseline
+    confidence = 1.0 - runner_up / peak if peak > 0 else 0.0
+
+    offset = float(lags[best]) / rate
+    footage_start = LogParser.epoch + timedelta(microseconds=int(log_start)) + timedelta(seconds=offset)
+    return {
+        'start_date': footage_start + timedelta(seconds=start_second),
+        'offset': offset,
+        'correlation': scores[best],
+        'confidence': confidence
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Proposes the --start-date of a ride by matching the motion of the '
+                                                 'footage with the log')
+    parser.add_argument('log_file', type=str, help='Path to the logfile used to annotate the video')
+    parser.add_argument('video_file', type=str, help='Path to the video to be annotated')
+    parser.add_argument('--start-second', type=float, default=0,
+                        help='Second of the footage whose timestamp is proposed')
+    parser.add_argument('--unit', type=str, default='mm', choices=['mm', 'mi', 'im', 'ii'],
+                        help='Defines input output unit conversion with two letters. The first denotes the input unit '
+                             'and the second denotes the output unit.')
+    args = parser.parse_args()
+
+    sync = find_start_date(args.log_file, args.video_file, args.unit, args.start_second)
+    print 'Footage starts {:.1f}s into the log, correlation {:.2f}, confidence {:.0%}'.format(
+        sync['offset'], sync['correlation'], sync['confidence'])
+    print '--start-second', args.start_second, '--start-date', LogParser.format_millisecond_time(sync['start_date'])
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+import csv
+import json
+import multiprocessing
+import time
+import traceback
+from GlyphCache import default_cache_dir
+
+# manifest column names and the OnewheelHudVideo arguments they feed
+manifest_fields = {
+    'log_file': 'data_path',
+    'video_file': 'footage_path',
+    'start_second': 'start_second',
+    'start_date': 'start_date',
+    'end_second': 'end_second',
+    'unit': 'unit',
+    'output': 'out_path'
+}
+
+# IconManagers kept by each worker process between jobs, keyed by their constructor arguments
+worker_icon_managers = {}
+
+
+def load_manifest(manifest_path):
+    """
+    Loads the list of jobs from a JSON list of objects or from a CSV file with a header, both using the column names
+    in manifest_fields. Empty cells are left out so the defaults of OnewheelHudVideo apply
+    """
+    with open(manifest_path) as manifest_file:
+        if manifest_path.endswith('.json'):
+            rows = json.load(manifest_file)
+        else:
+            rows = list(csv.DictReader(manifest_file))
+
+    jobs = []
+    for row in rows:
+        job = {}
+        for field, argument in manifest_fields.items():
+            value = row.get(field)
+            if value is None or value == '':
+                continue
+            if field in ('start_second', 'end_second'):
+                value = float(value)
+            job[argument] = value
+        jobs.append(job)
+    return jobs
+
+
+def render_batch(jobs, workers=None, common_kwargs=None):
+    """
+    Renders every job on a pool of worker processes, each job being a dictionary of OnewheelHudVideo arguments
+    completed by common_kwargs. Workers keep their IconManagers between jobs and all of them share the same on-disk
+    glyph cache. Their atlases serve read-only memory-mapped views of its glyphs, so the pixels are held only once in
+    the page cache whatever the number of workers. Returns one result per job
+    """
+    common_kwargs = dict(common_kwargs or {})
+    common_kwargs.setdefault('glyph_cache_dir', default_cache_dir)
+    tasks = []
+    for i, job in enumerate(jobs):
+        kwargs = dict(common_kwargs)
+        kwargs.update(job)
+        tasks.append((i, kwargs))
+
+    workers = workers or multiprocessing.cpu_count()
+    print 'Rendering', len(tasks), 'jobs on', workers, 'workers...'
+    results = [None] * len(tasks)
+    pool = multiprocessing.Pool(processes=min(workers, max(len(tasks), 1)))
+    try:
+        for result in pool.imap_unordered(render_job, tasks):
+            results[result['job']] = result
+            print 'Job {job} {status} in {seconds:.1f}s: {output}'.format(**result)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def render_job(task):
+    """
+    Renders a single job in a worker process and reports how it went
+    """
+    from OnewheelHudVideo import OnewheelHudVideo
+
+    i, kwargs = task
+    start = time.time()
+    result = {'job': i, 'output': kwargs.get('out_path'), 'status': 'done', 'error': None}
+    try:
+        video = OnewheelHudVideo(**kwargs)
+        key = repr(sorted(video.icon_manager_kwargs.items()))
+        video.icon_manager = worker_icon_managers.get(key)
+        video.render()
+        worker_icon_managers[key] = video.icon_manager
+    except Exception:
+        result['status'] = 'failed'
+        result['error'] = traceback.format_exc()
+    result['seconds'] = time.time() - start
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Renders the HUD videos of many rides on a pool of processes')
+    parser.add_argument('manifest', type=str,
+                        help='JSON or CSV file listing the jobs, with the columns log_file, video_file, start_second, '
+                             'start_date, end_second, unit and output')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of jobs rendered at the same time. Defaults to the number of CPUs.')
+    parser.add_argument('--backend', type=str, default='moviepy', choices=['moviepy', 'ffmpeg', 'pipeline'],
+                        help='What composites the HUD over the footage of every job, as in OnewheelHudVideo.py')
+    parser.add_argument('--fast-decode', action='store_true',
+                        help='Reads the footage of every job through an ffmpeg pipe that seeks, scales and rotates it '
+                             'before it reaches Python')
+    parser.add_argument('--glyph-cache', type=str, default=default_cache_dir,
+                        help='Directory of the glyph cache shared by all jobs')
+    parser.add_argument('--results', type=str, default=None, help='Writes the result of every job to this JSON file')
+    args = parser.parse_args()
+
+    results = render_batch(load_manifest(args.manifest), args.workers, {
+        'backend': args.backend,
+        'fast_decode': args.fast_decode,
+        'glyph_cache_dir': args.glyph_cache
+    })
+    if args.results is not None:
+        with open(args.results, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+
+    failed = [result for result in results if result['status'] != 'done']
+    print len(results) - len(failed), 'jobs done,', len(failed), 'failed'
+    for result in failed:
+        print 'Job', result['job'], 'failed:'
+        print result['error']
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class HudBlender:
+    """
+    Alpha-composites the RGBA HUD into RGB footage frames in place, touching only the region the HUD covers: the bottom
+    strip in portrait and the right column in landscape. The HUD is premultiplied into uint16 arrays whenever it changes
+    and every frame is then blended with integer arithmetic into preallocated arrays the size of that region, so no
+    temporary the size of the frame is ever created
+    """
+    def __init__(self, frame_shape, hud_shape, orientation):
+        h, w = hud_shape[:2]
+        self.region = hud_region(frame_shape, hud_shape, orientation)
+        self.premultiplied = np.empty((h, w, 3), dtype=np.uint16)
+        self.inverse_alpha = np.empty((h, w, 1), dtype=np.uint16)
+        self.blended = np.empty((h, w, 3), dtype=np.uint16)
+        self.carry = np.empty((h, w, 3), dtype=np.uint16)
+        self.hud_version = None
+
+    def set_hud(self, hud):
+        """
+        Premultiplies the RGBA hud by its alpha, adding the rounding bias of the division by 255 done in blend
+        """
+        np.copyto(self.inverse_alpha, hud[:, :, 3:])
+        np.multiply(hud[:, :, :3], self.inverse_alpha, out=self.premultiplied)
+        self.premultiplied += 128
+        np.subtract(255, self.inverse_alpha, out=self.inverse_alpha)
+
+    def blend(self, frame, hud, version=None):
+        """
+        Blends hud over frame in place and returns frame. The hud is premultiplied again only when version, which
+        should change whenever the hud does, differs from the last one, or when no version is given
+        """
+        if version is None or version != self.hud_version:
+            self.set_hud(hud)
+            self.hud_version = version
+
+        region = frame[self.region]
+        # footage * (255 - alpha) + hud * alpha + 128 fits in 16 bits
+        np.multiply(region, self.inverse_alpha, out=self.blended)
+        self.blended += self.premultiplied
+        # divides by 255 rounding to the nearest: (x + (x >> 8)) >> 8, the bias being already in x
+        np.right_shift(self.blended, 8, out=self.carry)
+        self.blended += self.carry
+        self.blended >>= 8
+        np.copyto(region, self.blended, casting='unsafe')
+        return frame
+
+
+def hud_region(frame_shape, hud_shape, orientation):
+    """
+    Returns the slices of a frame covered by the HUD: centered along the bottom edge in portrait and along the right
+    edge in landscape, as laid out by compute_resolutions
+    """
+    frame_h, frame_w = frame_shape[:2]
+    h, w = hud_shape[:2]
+    if orientation == 'portrait':
+        y, x = frame_h - h, (frame_w - w) // 2
+    else:
+        y, x = (frame_h - h) // 2, frame_w - w
+    return np.s_[y:y + h, x:x + w]
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import hashlib
+import inspect
+import json
+import math
+import multiprocessing
+import os
+import shutil
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+import LogParser
+from SegmentedRender import build_segment_kwargs, concat_segments, render_segment, split_segments
+
+# seconds of footage in each chunk of a checkpointed render
+chunk_seconds = 60.0
+
+# bytes read from each end of the footage to fingerprint it, as hashing a file of several gigabytes takes minutes
+footage_sample_bytes = 1024 * 1024
+
+# arguments of OnewheelHudVideo that change where or how fast the video is made, but not what it looks like
+ignored_settings = ['data_path', 'footage_path', 'out_path', 'report_path', 'profile_path', 'glyph_cache_dir',
+                    'glyph_cache_size', 'atlas_budget', 'clip_cache_size', 'queue_size']
+
+manifest_name = 'manifest.json'
+
+
+def render_checkpointed(video_kwargs, seconds=chunk_seconds, workers=None):
+    """
+    Renders the video described by video_kwargs, the arguments of OnewheelHudVideo, as consecutive chunks of about
+    seconds of footage each, kept in a directory next to the output with a manifest of the settings they were rendered
+    with. Run again with the same settings, only the chunks that are missing or invalid are rendered, so an interrupted
+    render resumes where it stopped. The chunks are joined into the final output without re-encoding
+    """
+    from OnewheelHudVideo import render_fps
+    # the chunks are cut on the frames of the footage that are rendered
+    fps = float(video_kwargs.get('fps', render_fps)) / video_kwargs.get('stride', 1)
+
+    start_second = video_kwargs.get('start_second', 0)
+    end_second = video_kwargs.get('end_second')
+    if end_second is None:
+        end_second = ffmpeg_parse_infos(video_kwargs['footage_path'])['duration']
+    start_date = video_kwargs['start_date']
+    if not isinstance(start_date, datetime):
+        start_date = LogParser.parse_millisecond_time(start_date)
+
+    out_path = video_kwargs['out_path']
+    chunk_dir = out_path + '.chunks'
+    manifest_path = os.path.join(chunk_dir, manifest_name)
+    settings = describe_render(video_kwargs, start_second, end_second, start_date, seconds)
+    manifest = load_manifest(manifest_path)
+    if manifest is None or manifest['settings'] != settings:
+        if os.path.isdir(chunk_dir):
+            print 'The chunks in', chunk_dir, 'were rendered with other settings, starting over'
+            shutil.rmtree(chunk_dir)
+        os.makedirs(chunk_dir)
+        manifest = {'settings': settings, 'chunks': {}}
+        write_manifest(manifest_path, manifest)
+
+    extension = os.path.splitext(out_path)[1]
+    n_chunks = max(1, int(math.ceil((end_second - start_second) / seconds - 1e-9)))
+    chunk_paths = []
+    pending = {}
+    for i, (chunk_start, chunk_end) in enumerate(split_segments(start_second, end_second, n_chunks, fps)):
+        name = 'chunk_{:04d}{}'.format(i, extension)
+        chunk_paths.append(os.path.join(chunk_dir, name))
+        if not chunk_is_valid(chunk_paths[-1], manifest['chunks'].get(name)):
+            # rendered under another name first, so that a chunk cut short never looks complete
+            partial_path = os.path.join(chunk_dir, 'chunk_{:04d}.partial{}'.format(i, extension))
+            manifest['chunks'].pop(name, None)
+            pending[partial_path] = (name, build_segment_kwargs(video_kwargs, i, chunk_start, chunk_end, end_second,
+                                                                start_date, partial_path))
+
+    print '{} of {} chunks already rendered, rendering {}...'.format(n_chunks - len(pending), n_chunks, len(pending))
+    if pending:
+        jobs = [job for _, job in sorted(pending.values())]
+        pool = multiprocessing.Pool(processes=workers or min(len(jobs), multiprocessing.cpu_count()))
+        failures = []
+        try:
+            for partial_path, error in pool.imap_unordered(render_chunk, jobs):
+                name = pending[partial_path][0]
+                if error is not None:
+                    print 'Chunk', name, 'failed:', error
+                    failures.append(name)
+                    continue
+                path = os.path.join(chunk_dir, name)
+                os.rename(partial_path, path)
+                manifest['chunks'][name] = {
+                    'bytes': os.path.getsize(path),
+                    'duration': ffmpeg_parse_infos(path)['duration']
+                }
+                write_manifest(manifest_path, manifest)
+                print 'Chunk', name, 'done'
+        finally:
+            pool.terminate()
+            pool.join()
+        if failures:
+            raise Exception('{} chunks failed, the other ones are kept in {} for the next run'.format(len(failures),
+                                                                                                     chunk_dir))
+
+    print 'Joining chunks...'
+    concat_segments(chunk_paths, out_path)
+    shutil.rmtree(chunk_dir)
+
+
+def render_chunk(chunk_kwargs):
+    """
+    Renders a single chunk in a worker process. Errors are returned rather than raised, so that one failed chunk does
+    not stop the chunks being rendered by the other workers from being recorded
+    """
+    try:
+        return render_segment(chunk_kwargs), None
+    except Exception as e:
+        return chunk_kwargs['out_path'], '{}: {}'.format(type(e).__name__, e)
+
+
+def describe_render(video_kwargs, start_second, end_second, start_date, seconds):
+    """
+    Returns everything that makes the chunks look the way they do, as it reads back from the manifest: the fingerprints
+    of the log and of the footage, the time window, the chunk length and every argument of OnewheelHudVideo that
+    changes the picture, defaults included
+    """
+    from OnewheelHudVideo import OnewheelHudVideo
+    names, _, _, defaults = inspect.getargspec(OnewheelHudVideo.__init__)
+    settings = dict(zip(names[-len(defaults):], defaults))
+    settings.update(video_kwargs)
+    for name in ignored_settings:
+        settings.pop(name, None)
+    settings.update({
+        'log_hash': hash_file(video_kwargs['data_path']),
+        'footage_hash': fingerprint_file(video_kwargs['footage_path']),
+        'start_second': start_second,
+        'end_second': end_second,
+        'start_date': LogParser.format_millisecond_time(start_date),
+        'chunk_seconds': seconds
+    })
+    return json.loads(json.dumps(settings, sort_keys=True))
+
+
+def hash_file(path, block_size=1024 * 1024):
+    """
+    Returns the SHA-1 of the whole file
+    """
+    digest = hashlib.sha1()
+    with open(path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint_file(path, sample_bytes=footage_sample_bytes):
+    """
+    Returns the SHA-1 of the size of the file and of sample_bytes at each of its ends
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size))
+    with open(path, 'rb') as data_file:
+        digest.update(data_file.read(sample_bytes))
+        data_file.seek(max(size - sample_bytes, 0))
+        digest.update(data_file.read(sample_bytes))
+    return digest.hexdigest()
+
+
+def chunk_is_valid(path, record):
+    """
+    Tells whether the chunk at path was completed, still has the size recorded in the manifest and can still be read
+    by ffmpeg with the same duration
+    """
+    if record is None or not os.path.isfile(path) or os.path.getsize(path) != record['bytes']:
+        return False
+    try:
+        return abs(ffmpeg_parse_infos(path)['duration'] - record['duration']) < 1e-3
+    except (IOError, KeyError):
+        return False
+
+
+def load_manifest(path):
+    try:
+        with open(path) as manifest_file:
+            return json.load(manifest_file)
+    except (IOError, ValueError):
+        return None
+
+
+def write_manifest(path, manifest):
+    """
+    Writes the manifest next to its final path before moving it there, so an interruption never leaves half of it
+    """
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.rename(temporary_path, path)
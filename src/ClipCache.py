@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import weakref
+
+
+class ClipCache:
+    """
+    Dictionary of icon clips that holds at most max_bytes of image data. Once over budget the least recently used clips
+    are evicted. A max_bytes of None never evicts. Hits, misses, evictions and the bytes held are kept in stats.
+    An evicted clip is only freed once nothing else references it, so the budget bounds memory only for callers that
+    do not keep the clips themselves. Until then, the evicted clip is handed out again instead of a duplicate
+    """
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.clips = OrderedDict()
+        # evicted clips that are still referenced somewhere else
+        self.evicted = weakref.WeakValueDictionary()
+        self.sizes = {}
+        self.nbytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'bytes': 0}
+
+    def __contains__(self, key):
+        return key in self.clips or key in self.evicted
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __getitem__(self, key):
+        if key not in self.clips:
+            # brought back into the budget, as it is being used again
+            self[key] = self.evicted.pop(key)
+            return self.clips[key]
+        # reinserting moves the clip to the most recently used end
+        clip = self.clips.pop(key)
+        self.clips[key] = clip
+        return clip
+
+    def __setitem__(self, key, clip):
+        if key in self.clips:
+            self.remove(key)
+        self.clips[key] = clip
+        self.sizes[key] = clip_nbytes(clip)
+        self.nbytes += self.sizes[key]
+        self.stats['bytes'] = self.nbytes
+
+        # never evicts the clip just added, even if it does not fit on its own
+        while self.max_bytes is not None and self.nbytes > self.max_bytes and len(self.clips) > 1:
+            oldest = next(iter(self.clips))
+            self.evicted[oldest] = self.clips[oldest]
+            self.remove(oldest)
+            self.stats['evictions'] += 1
+
+    def remove(self, key):
+        del self.clips[key]
+        self.nbytes -= self.sizes.pop(key)
+        self.stats['bytes'] = self.nbytes
+
+    def clear(self):
+        self.clips.clear()
+        self.evicted.clear()
+        self.sizes.clear()
+        self.nbytes = 0
+        self.stats['bytes'] = 0
+
+
+def clip_nbytes(clip, seen=None):
+    """
+    Estimates the memory held by clip by adding up the images of the ImageClips it is made of, masks included. Images
+    shared between the parts of a composite are only counted once
+    """
+    if seen is None:
+        seen = set()
+    nbytes = 0
+    img = getattr(clip, 'img', None)
+    if img is not None and id(img) not in seen:
+        seen.add(id(img))
+        nbytes += img.nbytes
+    for part in getattr(clip, 'clips', []):
+        nbytes += clip_nbytes(part, seen)
+    mask = getattr(clip, 'mask', None)
+    if mask is not None:
+        nbytes += clip_nbytes(mask, seen)
+    return nbytes
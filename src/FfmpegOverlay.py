@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import tqdm
+from moviepy.config import get_setting
+from FootageReader import footage_filters
+
+# where the HUD goes on the final frame, as laid out by compute_resolutions
+overlay_positions = {
+    'portrait': 'x=(main_w-overlay_w)/2:y=main_h-overlay_h',
+    'landscape': 'x=main_w-overlay_w:y=(main_h-overlay_h)/2'
+}
+
+
+def build_overlay_command(footage_path, out_path, hud_size, start_second, duration, fps, footage_size,
+                          transpose=False, orientation='portrait', preset=None, speed=1):
+    """
+    Builds the ffmpeg command that seeks into the footage, scales it to footage_size (width, height), optionally
+    rotates it clockwise and overlays the raw RGBA HUD frames read from stdin along the bottom edge in portrait or the
+    right edge in landscape. A speed above 1 makes a silent time-lapse of the footage
+    """
+    filter_graph = ('[0:v]{}[footage];'
+                    '[footage][1:v]overlay={}:shortest=1[out]'
+                    .format(footage_filters(fps, footage_size, transpose, speed), overlay_positions[orientation]))
+
+    command = [get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+               '-ss', str(start_second), '-t', str(duration), '-i', footage_path,
+               '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '{}x{}'.format(hud_size[1], hud_size[0]),
+               '-framerate', str(fps), '-i', 'pipe:0',
+               '-filter_complex', filter_graph, '-map', '[out]']
+    if speed == 1:
+        command += ['-map', '0:a?']
+    command += ['-c:v', 'libx264']
+    if preset is not None:
+        command += ['-preset', preset]
+    return command + ['-c:a', 'aac', out_path]
+
+
+def render_overlay(footage_path, out_path, renderer, start_second, duration, fps, footage_size, transpose=False,
+                   preset=None, speed=1):
+    """
+    Renders the final video with ffmpeg doing all the work on the footage, while renderer, a HudRenderer, draws each
+    HUD frame that is piped to it
+    """
+    command = build_overlay_command(footage_path, out_path, renderer.size, start_second, duration, fps, footage_size,
+                                    transpose, renderer.orientation, preset, speed)
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    n_frames = int(round(float(duration) / speed * fps))
+    try:
+        for i in tqdm.tqdm(range(n_frames)):
+            process.stdin.write(renderer.render(float(i) / fps).tobytes())
+    except IOError:
+        # ffmpeg stopped reading, its exit code below tells why
+        pass
+    finally:
+        process.stdin.close()
+
+    if process.wait() != 0:
+        raise Exception('ffmpeg failed with exit code {}'.format(process.returncode))
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import numpy as np
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+# how far ahead, in seconds, a request may jump before ffmpeg is restarted with a new seek instead of skipping frames
+max_skip_seconds = 2.0
+
+
+class FootageReader:
+    """
+    Reads footage from an ffmpeg pipe that seeks on input, converts the frame rate, scales and rotates the frames and
+    hands them over as raw RGB at the final resolution. Frames are read into a small ring of preallocated buffers, so
+    a frame stays valid until n_buffers more frames have been read. With a speed above 1 the duration seconds of
+    footage are played that many times faster, as a time-lapse
+    """
+    def __init__(self, footage_path, start_second, duration, size, fps, transpose=False, n_buffers=3, speed=1):
+        self.footage_path = footage_path
+        self.start_second = start_second
+        self.duration = duration
+        self.size = size
+        self.fps = fps
+        self.transpose = transpose
+        self.speed = speed
+        self.n_frames = int(round(float(duration) / speed * fps))
+
+        # size is given before the rotation, the frames come out transposed
+        w, h = (size[1], size[0]) if transpose else size
+        self.buffers = [np.empty((h, w, 3), dtype=np.uint8) for _ in range(n_buffers)]
+        self.next_buffer = 0
+        self.process = None
+        self.position = -1
+        self.frame = None
+
+    def open(self, i):
+        """
+        Starts ffmpeg so that the next frame read is frame i
+        """
+        self.close()
+        skipped = float(i) * self.speed / self.fps
+        command = [get_setting('FFMPEG_BINARY'), '-loglevel', 'error',
+                   '-ss', str(self.start_second + skipped), '-t', str(self.duration - skipped), '-i', self.footage_path,
+                   '-vf', footage_filters(self.fps, self.size, self.transpose, self.speed), '-an',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', 'pipe:1']
+        # ffmpeg complains about the broken pipe every time it is stopped early, so its messages are dropped
+        with open(os.devnull, 'w') as devnull:
+            self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=devnull,
+                                            bufsize=self.buffers[0].nbytes)
+        self.position = i - 1
+
+    def read_into(self, buffer):
+        """
+        Reads the next frame into buffer, returning False if the footage ended before the frame was complete
+        """
+        view = memoryview(buffer.reshape(-1))
+        filled = 0
+        while filled < buffer.nbytes:
+            n_read = self.process.stdout.readinto(view[filled:])
+            if not n_read:
+                break
+            filled += n_read
+        self.position += 1
+        return filled == buffer.nbytes
+
+    def read_frame(self):
+        """
+        Reads the next frame into the next buffer of the ring and returns it. If the footage ends early the last frame
+        is repeated
+        """
+        buffer = self.buffers[self.next_buffer]
+        if not self.read_into(buffer):
+            if self.frame is not None:
+                return self.frame
+            buffer[:] = 0
+
+        self.next_buffer = (self.next_buffer + 1) % len(self.buffers)
+        self.frame = buffer
+        return buffer
+
+    def get_frame(self, t):
+        """
+        Returns the frame shown at time t, in seconds from start_second. Moving forward reads and drops the frames in
+        between, while moving backwards or far ahead restarts ffmpeg with a new input seek
+        """
+        i = min(max(int(round(t * self.fps)), 0), self.n_frames - 1)
+        if i == self.position and self.frame is not None:
+            return self.frame
+        if self.process is None or i < self.position or i - self.position > max_skip_seconds * self.fps:
+            self.open(i)
+        while self.position < i:
+            self.read_frame()
+        return self.frame
+
+    def close(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.stdout.close()
+            self.process.wait()
+            self.process = None
+
+
+def footage_filters(fps, size, transpose=False, speed=1):
+    """
+    Returns the ffmpeg filter chain converting the footage to fps and scaling it to size (width, height), rotating it
+    clockwise afterwards if transpose is set. A speed above 1 plays the footage that many times faster first
+    """
+    filters = 'fps={},scale={}:{}'.format(fps, size[0], size[1])
+    if speed != 1:
+        filters = 'setpts=(PTS-STARTPTS)/{},{}'.format(speed, filters)
+    if transpose:
+        filters += ',transpose=clock'
+    return filters
+
+
+def probe_footage(footage_path):
+    """
+    Returns ffmpeg's description of the footage, including its 'duration' in seconds and whether 'audio_found'
+    """
+    return ffmpeg_parse_infos(footage_path)
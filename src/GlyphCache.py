@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import errno
+import hashlib
+import os
+import numpy as np
+
+# bump whenever the way glyphs are drawn changes, so stale entries are never reused
+cache_version = 1
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'onewheel-video-hud', 'glyphs')
+
+
+def make_dirs(path):
+    """
+    Creates the directory at path and its parents, unless another process running at the same time already did
+    """
+    try:
+        os.makedirs(path)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+class GlyphCache:
+    """
+    Content addressed on-disk store of rasterized glyphs shared by every render. Each glyph is kept as its own .npy
+    file and loaded memory-mapped. Once the files take more than max_bytes the least recently used ones are deleted
+    """
+    def __init__(self, cache_dir=default_cache_dir, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        make_dirs(cache_dir)
+        self.size = sum(os.path.getsize(path) for path in self.entries())
+
+    def key(self, *parts):
+        """
+        Computes the cache key of a glyph from everything that affects its pixels
+        """
+        return hashlib.sha1(repr((cache_version,) + parts).encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.npy')
+
+    def entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith('.npy'):
+                    yield os.path.join(root, name)
+
+    def load(self, key):
+        """
+        Returns the memory-mapped glyph stored under key, or None if there is no such glyph
+        """
+        path = self.path(key)
+        try:
+            glyph = np.load(path, mmap_mode='r')
+        except (IOError, OSError, ValueError):
+            return None
+        # the modification time doubles as the last access time used for eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            # a read-only cache is still read, it just never learns which glyphs are used
+            pass
+        return glyph
+
+    def store(self, key, glyph):
+        path = self.path(key)
+        make_dirs(os.path.dirname(path))
+
+        # write to a temporary file first so concurrent renders never read a partial glyph
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp_path, 'wb') as glyph_file:
+            np.save(glyph_file, glyph)
+        os.rename(tmp_path, path)
+
+        self.size += os.path.getsize(path)
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """
+        Deletes the least recently used glyphs until the cache is back to 90% of its budget
+        """
+        entries = []
+        for path in self.entries():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+
+        self.size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.size -= size
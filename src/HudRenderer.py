@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import time
+import numpy as np
+
+# order in which the icons are laid along the HUD bar, with the row column feeding each one
+hud_layout = [
+    ('speed', 'speed'),
+    ('pitch', 'pitch'),
+    ('roll', 'roll'),
+    ('battery', 'battery'),
+    ('temperature', 'motor_temp')
+]
+
+
+class HudRenderer:
+    """
+    Draws the HUD bar straight into a preallocated RGBA buffer for any requested time, so the whole ride is exposed as
+    a single VideoClip instead of one clip per icon per frame. The buffer is kept between frames and only the icons
+    whose quantized value changed are redrawn
+    """
+    def __init__(self, atlas, row_source, orientation='portrait', instrumentation=None):
+        self.atlas = atlas
+        self.instrumentation = instrumentation
+        self.row_source = row_source
+        self.orientation = orientation
+        self.tile_h = atlas.tile_h
+        self.tile_w = atlas.tile_w
+
+        n_icons = len(hud_layout)
+        if orientation == 'portrait':
+            # a horizontal bar
+            self.size = (self.tile_h, self.tile_w * n_icons)
+        elif orientation == 'landscape':
+            # a vertical bar
+            self.size = (self.tile_h * n_icons, self.tile_w)
+        else:
+            raise Exception("Orientation not set")
+
+        self.buffer = np.zeros(self.size + (4,), dtype=np.uint8)
+        self.last_t = None
+        self.tile_indices = [None] * n_icons
+        # bumped whenever the buffer changes
+        self.version = 0
+        self.frame_count = 0
+        self.change_counts = dict((metric, 0) for metric, _ in hud_layout)
+
+    def render(self, t):
+        """
+        Fills the RGBA buffer with the HUD at time t (in seconds from the start of the footage) and returns it
+        """
+        if t == self.last_t:
+            return self.buffer
+
+        start = time.time()
+        row = self.row_source(t)
+        for i, (metric, column) in enumerate(hud_layout):
+            index = self.atlas.quantize(metric, row[column])
+            if index == self.tile_indices[i]:
+                continue
+            self.blit(i, self.atlas.get_index(metric, index))
+            self.tile_indices[i] = index
+            self.change_counts[metric] += 1
+            self.version += 1
+
+        self.frame_count += 1
+        self.last_t = t
+        if self.instrumentation is not None:
+            self.instrumentation.record_frame_time('hud', time.time() - start)
+        return self.buffer
+
+    def tile_slice(self, i):
+        """
+        Returns the region of the buffer occupied by the i-th icon
+        """
+        if self.orientation == 'portrait':
+            return np.s_[:, i * self.tile_w:(i + 1) * self.tile_w]
+        else:
+            return np.s_[i * self.tile_h:(i + 1) * self.tile_h, :]
+
+    def blit(self, i, tile):
+        self.buffer[self.tile_slice(i)] = tile
+
+    def change_rates(self):
+        """
+        Returns, for each metric, the fraction of the rendered frames in which its icon had to be redrawn
+        """
+        return dict((metric, count / float(max(self.frame_count, 1))) for metric, count in self.change_counts.items())
+
+    def make_frame(self, t):
+        return self.render(t)[:, :, :3]
+
+    def make_mask_frame(self, t):
+        return self.render(t)[:, :, 3] / 255.0
+
+    def to_clip(self, duration):
+        """
+        Wraps the renderer in a masked VideoClip that can be composited over the footage
+        """
+        from moviepy.editor import VideoClip
+        clip = VideoClip(make_frame=self.make_frame, duration=duration)
+        mask = VideoClip(make_frame=self.make_mask_frame, ismask=True, duration=duration)
+        return clip.set_mask(mask)
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import math
+import numpy as np
+
+# IconManager getter used to draw each metric
+icon_getters = {
+    'speed': 'get_animated_speed_icon_clip',
+    'pitch': 'get_pitch_icon_clip',
+    'roll': 'get_roll_icon_clip',
+    'battery': 'get_battery_icon_clip',
+    'temperature': 'get_temperature_icon_clip'
+}
+
+# quantization step of each metric, matching the precision of the text shown on the icons
+default_steps = {
+    'speed': 0.1,
+    'pitch': 0.1,
+    'roll': 0.1,
+    'battery': 1.0,
+    'temperature': 1.0
+}
+
+
+class IconAtlas:
+    """
+    Keeps every icon drawn so far pre-rasterized as a uint8 RGBA glyph, indexed by the quantized value it shows. Each
+    metric holds as many glyphs as an equal share of max_bytes allows, and once its share is full the least recently
+    used glyph is dropped. Without a GlyphCache the glyphs live in a contiguous private array per metric. With one, the
+    atlas hands out read-only memory-mapped views of the glyph files instead, including of the glyphs it draws itself
+    once they are stored, so renders running at the same time hold their pixels only once, in the page cache
+    """
+    def __init__(self, icon_manager, steps=None, max_bytes=64 * 1024 * 1024, disk_cache=None):
+        self.icon_manager = icon_manager
+        self.disk_cache = disk_cache
+        self.steps = dict(default_steps)
+        if steps is not None:
+            self.steps.update(steps)
+        self.tile_h = int(round(icon_manager.resolution[0]))
+        self.tile_w = int(round(icon_manager.resolution[1]))
+
+        tile_bytes = self.tile_h * self.tile_w * 4
+        self.capacity = max(1, int(max_bytes // (tile_bytes * len(icon_getters))))
+        self.glyphs = {}
+        # each icon is drawn here before it is stored in the disk cache
+        self.scratch = np.zeros((self.tile_h, self.tile_w, 4), dtype=np.uint8)
+        self.slots = {}
+        self.stats = dict((metric, {'hits': 0, 'misses': 0, 'disk_hits': 0}) for metric in icon_getters)
+        for metric in icon_getters:
+            # slots are handed out in order, so only the used part of each array is ever touched. With a disk cache
+            # they are only used when a glyph cannot be stored
+            self.glyphs[metric] = np.zeros((self.capacity, self.tile_h, self.tile_w, 4), dtype=np.uint8)
+            self.slots[metric] = OrderedDict()
+
+    def quantize(self, metric, value):
+        """
+        Returns the integer index of value on the metric's quantization grid
+        """
+        if value is None or math.isnan(value):
+            value = 0.0
+        return int(round(value / self.steps[metric]))
+
+    def get(self, metric, value):
+        """
+        Returns the RGBA glyph showing value for the given metric, rasterizing it on a miss
+        """
+        return self.get_index(metric, self.quantize(metric, value))
+
+    def get_index(self, metric, index):
+        """
+        Returns the RGBA glyph at the given quantized index for the given metric, rasterizing it on a miss
+        """
+        slots = self.slots[metric]
+        if index in slots:
+            # mark as most recently used
+            self.stats[metric]['hits'] += 1
+            slot, glyph = slots.pop(index)
+            slots[index] = slot, glyph
+            return glyph
+
+        self.stats[metric]['misses'] += 1
+        if len(slots) < self.capacity:
+            slot = len(slots)
+        else:
+            _, (slot, _) = slots.popitem(last=False)
+
+        glyph = self.draw(metric, index, self.glyphs[metric][slot])
+        slots[index] = slot, glyph
+        return glyph
+
+    def draw(self, metric, index, out):
+        """
+        Returns the glyph of the icon at the given quantized index: a read-only view of the disk cache if there is one,
+        otherwise out with the icon rasterized into it
+        """
+        key = None
+        if self.disk_cache is not None:
+            key = self.disk_cache.key(self.icon_manager.cache_signature(), (self.tile_h, self.tile_w), metric,
+                                      self.steps[metric], index)
+            glyph = self.disk_cache.load(key)
+            if glyph is not None and glyph.shape == out.shape:
+                self.stats[metric]['disk_hits'] += 1
+                return glyph
+
+        getter = getattr(self.icon_manager, icon_getters[metric])
+        icon_clip = getter(index * self.steps[metric])
+        rasterize_clip(icon_clip, self.scratch if key is not None else out)
+        # the clip is not needed once its pixels are in the atlas
+        self.icon_manager.cached_clips[metric].clear()
+
+        if key is not None:
+            self.disk_cache.store(key, self.scratch)
+            glyph = self.disk_cache.load(key)
+            if glyph is not None and glyph.shape == out.shape:
+                return glyph
+            out[:] = self.scratch
+        return out
+
+    def nbytes(self):
+        return sum(glyphs.nbytes for glyphs in self.glyphs.values())
+
+
+def rasterize_clip(clip, out):
+    """
+    Copies the first frame of clip and its mask into the RGBA uint8 array out, cropping or padding to fit
+    """
+    from IconManager import clip_to_rgba
+    h, w = out.shape[:2]
+    rgba = clip_to_rgba(clip)[:h, :w]
+    out[:] = 0
+    out[:rgba.shape[0], :rgba.shape[1]] = rgba
+    return out
@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from moviepy.editor import *
+from TextRenderer import TextRenderer
+from RotationTable import RotationTable
+from ClipCache import ClipCache
+import numpy as np
 
 
 class IconManager:
     def __init__(self, resolution=(30, 30), padding=10, font='Arial',
-                 fontsize=50, txt_position=(0.5, 0.8), unit_position=(0.5, 0.2), unit='metric'):
+                 fontsize=50, txt_position=(0.5, 0.8), unit_position=(0.5, 0.2), unit='metric',
+                 text_engine='pillow', rotation_step=None, rotation_workers=None, clip_cache_bytes=None):
         self.resolution = resolution
         self.padding = padding
         self.icon_size = tuple(map(lambda x: x - padding, resolution))
@@ -32,15 +37,35 @@ class IconManager:
                 'speed_min': 0.0
             }
         }
+        self.unit_name = unit
         self.unit = self.units[unit]
         self.unit_position = unit_position
+        self.text_engine = text_engine
+        self.rotation_step = rotation_step
+        self.rotation_workers = rotation_workers
+        self.rotation_tables = {}
+        self.text_renderer = None
+        if text_engine == 'pillow':
+            self.text_renderer = TextRenderer(font)
+            self.text_renderer.prerender(fontsize)
+            self.text_renderer.prerender(fontsize / 2, [self.unit['speed'], self.unit['temperature']])
+        # clip_cache_bytes is the budget of each metric's cache, None keeps every clip
         self.cached_clips = {
-            'roll': {},
-            'pitch': {},
-            'speed': {},
-            'battery': {},
-            'temperature': {}
+            'roll': ClipCache(clip_cache_bytes),
+            'pitch': ClipCache(clip_cache_bytes),
+            'speed': ClipCache(clip_cache_bytes),
+            'battery': ClipCache(clip_cache_bytes),
+            'temperature': ClipCache(clip_cache_bytes)
         }
+        self.cache_stats = dict((name, cache.stats) for name, cache in self.cached_clips.items())
+
+    def cache_signature(self):
+        """
+        Returns everything besides the value that changes how an icon looks, to be used as part of a cache key
+        """
+        return (tuple(self.resolution), self.padding, self.font, self.fontsize, tuple(self.txt_position),
+                tuple(self.unit_position), self.unit_name, self.text_engine,
+                self.rotation_step)
 
     def get_roll_icon_clip(self, angle=0.0, duration=1.0):
         # fixes invalid angle value
@@ -52,7 +77,9 @@ class IconManager:
 
         # if we have a cache hit, use the cached value
         if angle_str in self.cached_clips['roll']:
+            self.cache_stats['roll']['hits'] += 1
             return self.cached_clips['roll'][angle_str]
+        self.cache_stats['roll']['misses'] += 1
 
         # else, create a new clip
         if self.roll_icon_clip is None:
@@ -63,12 +90,11 @@ class IconManager:
             self.roll_icon_clip = self.roll_icon_clip.set_duration(duration)
 
         # rotate it as needed
-        rotated_icon_clip = (self.roll_icon_clip
-                             .rotate(float(angle), expand=False)
+        rotated_icon_clip = (self.rotate_icon_clip('roll', self.roll_icon_clip, float(angle), duration)
                              .on_color(col_opacity=0, size=self.resolution, pos='center'))
 
         # generate a new text to go with the icon
-        angle_txt_clip = TextClip(angle_str, fontsize=self.fontsize, font=self.font).set_duration(duration)
+        angle_txt_clip = self.make_text_clip(angle_str, self.fontsize, duration)
         new_icon_clip = self.composite_icon_text(rotated_icon_clip, angle_txt_clip, self.txt_position)
 
         # add it to the cache
@@ -87,7 +113,9 @@ class IconManager:
 
         # if we have a cache hit, use the cached value
         if angle_str in self.cached_clips['pitch']:
+            self.cache_stats['pitch']['hits'] += 1
             return self.cached_clips['pitch'][angle_str]
+        self.cache_stats['pitch']['misses'] += 1
 
         # else, create a new clip
         if self.pitch_icon_clip is None:
@@ -98,13 +126,13 @@ class IconManager:
         else:
             self.pitch_icon_clip = self.pitch_icon_clip.set_duration(duration)
 
-        # rotate it as needed
-        rotated_icon_clip = (self.pitch_icon_clip
-                             .rotate(float(angle), expand=False)
-                             .resize(self.resolution))
+        # rotate it as needed. The rotation keeps the size of the icon, so it is only resized if that is off
+        rotated_icon_clip = self.rotate_icon_clip('pitch', self.pitch_icon_clip, float(angle), duration)
+        if tuple(rotated_icon_clip.size) != tuple(self.resolution):
+            rotated_icon_clip = rotated_icon_clip.resize(self.resolution)
 
         # generate a new text to go with the icon
-        angle_txt_clip = TextClip(angle_str, fontsize=self.fontsize, font=self.font).set_duration(duration)
+        angle_txt_clip = self.make_text_clip(angle_str, self.fontsize, duration)
         new_icon_clip = self.composite_icon_text(rotated_icon_clip, angle_txt_clip, self.txt_position)
 
         # add it to the cache
@@ -123,7 +151,9 @@ class IconManager:
 
         # if we have a cache hit, use the cached value
         if charge_str in self.cached_clips['battery']:
+            self.cache_stats['battery']['hits'] += 1
             return self.cached_clips['battery'][charge_str]
+        self.cache_stats['battery']['misses'] += 1
 
         # else, create a new clip
         icon_path = self.compute_battery_icon_path(charge)
@@ -132,7 +162,7 @@ class IconManager:
                                   .on_color(col_opacity=0, size=self.resolution, pos='center'))
 
         # generate a new text to go with the icon
-        charge_txt_clip = TextClip(charge_str, fontsize=self.fontsize, font=self.font).set_duration(duration)
+        charge_txt_clip = self.make_text_clip(charge_str, self.fontsize, duration)
         new_icon_clip = self.composite_icon_text(self.battery_icon_clip, charge_txt_clip, self.txt_position)
 
         # add it to the cache
@@ -170,7 +200,9 @@ class IconManager:
 
         # if we have a cache hit, use the cached value
         if speed_str in self.cached_clips['speed']:
+            self.cache_stats['speed']['hits'] += 1
             return self.cached_clips['speed'][speed_str]
+        self.cache_stats['speed']['misses'] += 1
 
         # else, create a new clip
         if self.speed_icon_clip is None:
@@ -182,7 +214,7 @@ class IconManager:
             self.speed_icon_clip = self.speed_icon_clip.set_duration(duration)
 
         # generate a new text to go with the icon
-        speed_txt_clip = TextClip(speed_str, fontsize=self.fontsize, font=self.font).set_duration(duration)
+        speed_txt_clip = self.make_text_clip(speed_str, self.fontsize, duration)
         new_icon_clip = self.composite_icon_text(self.speed_icon_clip, speed_txt_clip, self.txt_position)
 
         # add it to the cache
@@ -201,7 +233,9 @@ class IconManager:
 
         # if we have a cache hit, use the cached value
         if speed_str in self.cached_clips['speed']:
+            self.cache_stats['speed']['hits'] += 1
             return self.cached_clips['speed'][speed_str]
+        self.cache_stats['speed']['misses'] += 1
 
         # else, create a new clip
         if self.speed_icon_bg_clip is None:
@@ -229,15 +263,14 @@ class IconManager:
         angle = (a_max - a_min) * t + a_min
 
         final_speed_icon = CompositeVideoClip([self.speed_icon_bg_clip,
-                                               self.speed_icon_pointer_clip.rotate(-angle, expand=False,
-                                                                                   resample='nearest')])
+                                               self.rotate_icon_clip('speed_pointer', self.speed_icon_pointer_clip,
+                                                                     -angle, duration, resample='nearest')])
 
         # generate text to show speed
-        speed_txt_clip = TextClip(speed_str, fontsize=self.fontsize, font=self.font).set_duration(duration)
+        speed_txt_clip = self.make_text_clip(speed_str, self.fontsize, duration)
 
         # generate text to show unit
-        speed_unit_clip = (TextClip(self.unit['speed'], fontsize=self.fontsize / 2, font=self.font)
-                           .set_duration(duration))
+        speed_unit_clip = self.make_text_clip(self.unit['speed'], self.fontsize / 2, duration)
 
         # composite text with icon
         new_icon_clip = self.composite_icon_text(final_speed_icon, speed_txt_clip, self.txt_position)
@@ -259,7 +292,9 @@ class IconManager:
 
         # if we have a cache hit, use the cached value
         if temp_str in self.cached_clips['temperature']:
+            self.cache_stats['temperature']['hits'] += 1
             return self.cached_clips['temperature'][temp_str]
+        self.cache_stats['temperature']['misses'] += 1
 
         # else, create a new clip
         if self.temp_icon_clip is None:
@@ -271,9 +306,8 @@ class IconManager:
             self.temp_icon_clip = self.temp_icon_clip.set_duration(duration)
 
         # generate a new text to go with the icon
-        temp_txt_clip = TextClip(temp_str, fontsize=self.fontsize, font=self.font).set_duration(duration)
-        temp_unit_clip = (TextClip(self.unit['temperature'], fontsize=self.fontsize/2, font=self.font)
-                          .set_duration(duration))
+        temp_txt_clip = self.make_text_clip(temp_str, self.fontsize, duration)
+        temp_unit_clip = self.make_text_clip(self.unit['temperature'], self.fontsize / 2, duration)
         new_icon_clip = self.composite_icon_text(self.temp_icon_clip, temp_txt_clip, self.txt_position)
         new_icon_clip = self.composite_icon_text(new_icon_clip, temp_unit_clip, self.unit_position)
 
@@ -283,6 +317,29 @@ class IconManager:
         # return it
         return new_icon_clip
 
+    def rotate_icon_clip(self, name, icon_clip, angle, duration, resample='bicubic'):
+        """
+        Rotates icon_clip counterclockwise by angle degrees. When a rotation step is set, every rotation of the icon is
+        computed once into a RotationTable, named after the icon, and the closest one is looked up instead
+        """
+        if not self.rotation_step:
+            return icon_clip.rotate(angle, expand=False, resample=resample)
+
+        if name not in self.rotation_tables:
+            table = RotationTable(clip_to_rgba(icon_clip), self.rotation_step, resample, self.rotation_workers)
+            print 'Built {} rotation table: {} angles, {:.1f} MB'.format(name, table.n_angles, table.nbytes / 1e6)
+            self.rotation_tables[name] = table
+        return ImageClip(self.rotation_tables[name].get(angle), duration=duration)
+
+    def make_text_clip(self, text, fontsize, duration):
+        """
+        Creates a clip showing text, either drawn in process by the TextRenderer or by ImageMagick through TextClip
+        """
+        if self.text_renderer is None:
+            return TextClip(text, fontsize=fontsize, font=self.font).set_duration(duration)
+        # the alpha channel of the rendered text becomes the clip's mask
+        return ImageClip(self.text_renderer.render(text, fontsize), duration=duration)
+
     def composite_icon_text(self, icon_clip, text_clip, position):
         off_x = text_clip.w / 2.0
         off_y = text_clip.h / 2.0
@@ -291,3 +348,17 @@ class IconManager:
             icon_clip.h * position[1] - off_y
         )
         return CompositeVideoClip([icon_clip, text_clip.set_position(txt_pos_in_px)])
+
+
+def clip_to_rgba(clip):
+    """
+    Returns the first frame of clip as an RGBA uint8 array, taking the alpha channel from its mask
+    """
+    rgb = clip.get_frame(0)
+    rgba = np.empty(rgb.shape[:2] + (4,), dtype=np.uint8)
+    rgba[:, :, :3] = rgb
+    if clip.mask is not None:
+        rgba[:, :, 3] = np.round(clip.mask.get_frame(0) * 255)
+    else:
+        rgba[:, :, 3] = 255
+    return rgba
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from contextlib import contextmanager
+import json
+import sys
+import time
+
+# upper bounds, in milliseconds, of the frame time histogram buckets. The last bucket takes everything slower
+histogram_bounds_ms = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512]
+
+
+class Instrumentation:
+    """
+    Opt-in measurements of a render: wall clock time and peak memory of each stage, and a histogram of how long each
+    frame took to produce. When disabled every method does nothing, so it can be called unconditionally
+    """
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = OrderedDict()
+        self.frame_times = OrderedDict()
+        self.sections = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = time.time()
+        yield
+        self.stages[name] = {
+            'seconds': time.time() - start,
+            'peak_rss_mb': peak_rss_mb()
+        }
+
+    def record_frame_time(self, name, seconds):
+        if not self.enabled:
+            return
+        if name not in self.frame_times:
+            self.frame_times[name] = {'count': 0, 'total': 0.0, 'max': 0.0,
+                                      'buckets': [0] * (len(histogram_bounds_ms) + 1)}
+        times = self.frame_times[name]
+        times['count'] += 1
+        times['total'] += seconds
+        times['max'] = max(times['max'], seconds)
+        milliseconds = seconds * 1000.0
+        bucket = 0
+        while bucket < len(histogram_bounds_ms) and milliseconds >= histogram_bounds_ms[bucket]:
+            bucket += 1
+        times['buckets'][bucket] += 1
+
+    def timed_frames(self, name, make_frame):
+        """
+        Wraps a function of t returning a frame so that the time spent producing each frame is recorded under name
+        """
+        if not self.enabled:
+            return make_frame
+
+        def timed_make_frame(t):
+            start = time.time()
+            frame = make_frame(t)
+            self.record_frame_time(name, time.time() - start)
+            return frame
+
+        return timed_make_frame
+
+    def add_section(self, name, values):
+        """
+        Adds extra values, such as cache statistics, to the report
+        """
+        self.sections[name] = values
+
+    def report(self):
+        frame_times = OrderedDict()
+        for name, times in self.frame_times.items():
+            labels = ['<{}'.format(bound) for bound in histogram_bounds_ms] + ['>={}'.format(histogram_bounds_ms[-1])]
+            frame_times[name] = OrderedDict([
+                ('count', times['count']),
+                ('mean_ms', times['total'] * 1000.0 / max(times['count'], 1)),
+                ('max_ms', times['max'] * 1000.0),
+                ('histogram_ms', OrderedDict(zip(labels, times['buckets'])))
+            ])
+
+        report = OrderedDict([
+            ('stages', self.stages),
+            ('frame_times', frame_times),
+            ('peak_rss_mb', peak_rss_mb())
+        ])
+        report.update(self.sections)
+        return report
+
+    def write_report(self, path):
+        with open(path, 'w') as report_file:
+            json.dump(self.report(), report_file, indent=2)
+
+
+@contextmanager
+def profiled(path):
+    """
+    Profiles the enclosed code and dumps the result to path, with pyinstrument as an HTML page if path ends in .html
+    and with cProfile otherwise. Does nothing if path is None
+    """
+    if path is None:
+        yield
+        return
+
+    if path.endswith('.html'):
+        from pyinstrument import Profiler
+        profiler = Profiler()
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            with open(path, 'w') as profile_file:
+                profile_file.write(profiler.output_html())
+    else:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+
+
+def peak_rss_mb():
+    """
+    Returns the peak resident memory of the process in megabytes, or None where it cannot be measured, as on Windows
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes everywhere else
+    if sys.platform == 'darwin':
+        return peak / (1024.0 * 1024.0)
+    return peak / 1024.0
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+from Blend import HudBlender
+
+# weight of the newest measurement in the running estimate of how long the HUD takes to draw
+cost_smoothing = 0.1
+
+# longest time, in seconds, the HUD is held before it is redrawn even if that makes frames late
+max_hold = 0.25
+
+# the original standard output once claim_stdout has been called
+raw_stdout = None
+
+
+class LivePreview:
+    """
+    Plays a ride in real time: every frame of the footage is read from a FootageReader, the HUD drawn by a HudRenderer
+    is laid over it and the result is written to a sink as soon as it is due. Each frame has budget seconds past the
+    moment it is due to reach the sink. A frame that cannot be started within its budget is dropped, and when drawing
+    the HUD would not fit in what is left of the budget the previous HUD is held instead, for up to max_hold seconds
+    """
+    def __init__(self, reader, renderer, sink, fps, budget=None):
+        self.reader = reader
+        self.renderer = renderer
+        self.sink = sink
+        self.fps = fps
+        self.budget = budget if budget is not None else 1.0 / fps
+        self.hud_cost = None
+        self.frame = None
+        self.blender = None
+        self.shown = 0
+        self.dropped = 0
+        self.held = 0
+
+    def play(self):
+        start = time.time()
+        for i in range(self.reader.n_frames):
+            t = float(i) / self.fps
+            due = start + t
+            now = time.time()
+            if now < due:
+                time.sleep(due - now)
+            elif now > due + self.budget:
+                self.dropped += 1
+                continue
+
+            footage = self.reader.get_frame(t)
+            if self.frame is None:
+                self.frame = np.empty_like(footage)
+                self.blender = HudBlender(footage.shape, self.renderer.size, self.renderer.orientation)
+            if (self.hud_cost is None or time.time() + self.hud_cost <= due + self.budget or
+                    t - self.renderer.last_t > max_hold):
+                hud_start = time.time()
+                self.renderer.render(t)
+                cost = time.time() - hud_start
+                if self.hud_cost is None:
+                    self.hud_cost = cost
+                self.hud_cost += cost_smoothing * (cost - self.hud_cost)
+            else:
+                self.held += 1
+
+            self.frame[:] = footage
+            self.blender.blend(self.frame, self.renderer.buffer, self.renderer.version)
+            try:
+                self.sink.write(self.frame)
+            except IOError:
+                # the player was closed
+                break
+            self.shown += 1
+
+        self.reader.close()
+        self.sink.close()
+        print 'Live preview: {} frames shown, {} dropped, {} with the HUD held, {:.1f} ms per HUD'.format(
+            self.shown, self.dropped, self.held, (self.hud_cost or 0.0) * 1000.0)
+
+
+class RawSink:
+    """
+    Writes frames as raw RGB bytes to a file object, such as a pipe into a player
+    """
+    def __init__(self, out):
+        self.out = out
+
+    def write(self, frame):
+        self.out.write(frame.tobytes())
+        self.out.flush()
+
+    def close(self):
+        self.out.close()
+
+
+class FfmpegSink:
+    """
+    Encodes frames with ffmpeg, as fast as possible, to a file or to a stream URL such as udp://127.0.0.1:1234 that a
+    local player can open. Frames are timestamped as they arrive, so dropped frames only make the previous one last
+    longer
+    """
+    def __init__(self, target, size, fps):
+        from moviepy.config import get_setting
+        command = [get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+                   '-use_wallclock_as_timestamps', '1',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '{}x{}'.format(size[0], size[1]),
+                   '-framerate', str(fps), '-i', 'pipe:0',
+                   '-c:v', 'libx264', '-preset', 'ultrafast', '-tune', 'zerolatency', '-pix_fmt', 'yuv420p']
+        if '://' in target:
+            command += ['-f', 'mpegts']
+        command.append(target)
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame):
+        self.process.stdin.write(frame.tobytes())
+
+    def close(self):
+        self.process.stdin.close()
+        self.process.wait()
+
+
+def open_sink(target, size, fps):
+    """
+    Opens the sink named by target: '-' for raw frames on the standard output claimed by claim_stdout, anything else
+    being a file or URL ffmpeg encodes to. size is the (width, height) of the frames
+    """
+    if target == '-':
+        return RawSink(raw_stdout)
+    return FfmpegSink(target, size, fps)
+
+
+def claim_stdout():
+    """
+    Keeps the standard output for raw frames and sends everything printed from then on to the standard error instead,
+    so that messages do not end up in the middle of the frames
+    """
+    global raw_stdout
+    sys.stdout.flush()
+    raw_stdout = os.fdopen(os.dup(1), 'wb')
+    os.dup2(2, 1)
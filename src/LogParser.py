@@ -1,6 +1,49 @@
 # -*- coding: utf-8 -*-
 import csv
-from datetime import datetime
+import itertools
+import os
+import shutil
+from datetime import datetime, timedelta
+import numpy as np
+
+# bump whenever the parsed columns change, so stale binary caches are never reused
+cache_version = 2
+
+column_names = ['time', 'speed', 'battery', 'roll', 'pitch', 'motor_temp', 'distance']
+
+epoch = datetime(1970, 1, 1)
+
+# offsets of the separators and of the digits in a yyyy-MM-dd'T'HH:mm:ss.SSS timestamp
+separator_offsets = [4, 7, 10, 13, 16, 19]
+separators = np.array([ord(c) for c in '--T::.'], dtype=np.uint8)
+digit_offsets = [i for i in range(23) if i not in separator_offsets]
+
+
+class LogColumns:
+    """
+    A parsed log stored as one array per column. Times are int64 microseconds since the unix epoch and every other
+    column is float64 with NaN where the log had no valid value
+    """
+    def __init__(self, columns):
+        self.columns = columns
+        for name in column_names:
+            setattr(self, name, columns[name])
+
+    def __len__(self):
+        return len(self.time)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def row(self, i):
+        """
+        Returns row i as a dictionary, in the same format as the rows returned by parse
+        """
+        row = {'time': epoch + timedelta(microseconds=int(self.time[i]))}
+        for name in column_names[1:]:
+            value = self.columns[name][i]
+            row[name] = None if np.isnan(value) else float(value)
+        return row
 
 
 def parse(file_path, unit):
@@ -26,6 +69,273 @@ def parse(file_path, unit):
     return data
 
 
+def parse_columns(file_path, unit, use_cache=True, window=None, chunk_size=10000):
+    """
+    Parses the log file generated by the pOnewheel app into a LogColumns, converting whole columns at once. The result
+    is kept in a directory of binary files next to the log, which is memory-mapped and reused while the log keeps the
+    same size and modification time. If a window of (start, end) datetimes is given, end being None for an open window,
+    only the rows inside it plus one guard row on each side are kept. The file is read in chunks of chunk_size rows,
+    each written to the cache as it is converted, so that memory depends on the length of the window rather than on
+    the length of the log
+    """
+    cache_dir = '{}.{}.cache'.format(file_path, unit)
+    stat = os.stat(file_path)
+    signature = np.array([cache_version, stat.st_size, stat.st_mtime])
+
+    start_us, end_us = None, None
+    if window is not None:
+        start_us = to_epoch_us(window[0])
+        if window[1] is not None:
+            end_us = to_epoch_us(window[1])
+
+    if use_cache:
+        data = load_cache(cache_dir, signature)
+        if data is not None:
+            print 'Loaded ', len(data), 'rows from', cache_dir
+            if window is not None:
+                data = slice_window(data, start_us, end_us)
+            return data
+
+    print 'Loading log file ', file_path, '...'
+    writer = open_cache_writer(cache_dir) if use_cache else None
+    chunks = []
+    guard = None
+    window_done = False
+    with open(file_path) as logfile:
+        log_reader = csv.reader(logfile)
+        header = next(log_reader)
+        source_names = ['time', 'speed', 'battery', 'tilt_angle_roll', 'tilt_angle_pitch', 'motor_temp', 'odometer']
+        indices = [header.index(name) for name in source_names]
+        while True:
+            rows = list(itertools.islice(log_reader, chunk_size))
+            if not rows:
+                break
+            chunk = parse_cells([[row[index] for row in rows] for index in indices], unit)
+            if writer is not None:
+                writer = writer.append(chunk)
+            if window is None:
+                chunks.append(chunk)
+                continue
+            if window_done:
+                # the rest of the log is only read for the cache
+                continue
+
+            time = chunk['time']
+            first = 0
+            if not chunks:
+                # the window has not been reached yet, remember the last row before it
+                first = np.searchsorted(time, start_us, side='left')
+                if first > 0:
+                    guard = take_rows(chunk, first - 1, first)
+                if first == len(time):
+                    continue
+                if guard is not None:
+                    chunks.append(guard)
+
+            last = len(time)
+            if end_us is not None:
+                last = np.searchsorted(time, end_us, side='right')
+            chunks.append(take_rows(chunk, first, min(last + 1, len(time))))
+            if last < len(time):
+                # the row after the window has been kept, there is no need to read further
+                window_done = True
+                if writer is None:
+                    break
+
+    if not chunks:
+        chunks.append(parse_cells([[] for _ in column_names], unit))
+    data = LogColumns(dict((name, np.concatenate([chunk[name] for chunk in chunks])) for name in column_names))
+    print 'Loaded ', len(data), 'rows'
+
+    if writer is not None:
+        writer.finish(signature)
+
+    return data
+
+
+class CacheWriter:
+    """
+    Writes the parsed columns of a log to the cache directory one chunk at a time. Everything goes to a temporary
+    directory that replaces the cache only once the whole log has been written, so a cache is never left half done
+    and renders running at the same time never read each other's files. If a write fails the cache is given up on and
+    the log is still parsed
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.temporary_dir = '{}.{}.tmp'.format(cache_dir, os.getpid())
+        self.n_rows = 0
+        self.files = {}
+        try:
+            if not os.path.isdir(self.temporary_dir):
+                os.makedirs(self.temporary_dir)
+            for name in column_names:
+                self.files[name] = open(os.path.join(self.temporary_dir, name + '.raw'), 'wb')
+        except (IOError, OSError):
+            self.abandon()
+            raise
+
+    def append(self, chunk):
+        """
+        Appends a chunk of columns, returning the writer, or None if the cache had to be given up on
+        """
+        try:
+            for name in column_names:
+                chunk[name].tofile(self.files[name])
+            self.n_rows += len(chunk['time'])
+            return self
+        except (IOError, OSError):
+            print 'Could not write log cache', self.cache_dir
+            self.abandon()
+            return None
+
+    def finish(self, signature):
+        """
+        Turns the raw columns into .npy files that can be memory-mapped and moves them into place, the signature last
+        """
+        try:
+            for name in column_names:
+                self.files[name].close()
+                raw_path = os.path.join(self.temporary_dir, name + '.raw')
+                dtype = np.int64 if name == 'time' else np.float64
+                with open(os.path.join(self.temporary_dir, name + '.npy'), 'wb') as npy_file:
+                    np.lib.format.write_array_header_1_0(npy_file, {
+                        'descr': np.lib.format.dtype_to_descr(np.dtype(dtype)),
+                        'fortran_order': False,
+                        'shape': (self.n_rows,)
+                    })
+                    with open(raw_path, 'rb') as raw_file:
+                        shutil.copyfileobj(raw_file, npy_file)
+                os.remove(raw_path)
+            np.save(os.path.join(self.temporary_dir, 'signature.npy'), signature)
+            if os.path.isdir(self.cache_dir):
+                shutil.rmtree(self.cache_dir)
+            os.rename(self.temporary_dir, self.cache_dir)
+        except (IOError, OSError):
+            print 'Could not write log cache', self.cache_dir
+            self.abandon()
+
+    def abandon(self):
+        for log_file in self.files.values():
+            log_file.close()
+        shutil.rmtree(self.temporary_dir, ignore_errors=True)
+
+
+def open_cache_writer(cache_dir):
+    """
+    Returns a CacheWriter for cache_dir, or None if its temporary directory cannot be created
+    """
+    try:
+        return CacheWriter(cache_dir)
+    except (IOError, OSError):
+        print 'Could not write log cache', cache_dir
+        return None
+
+
+def load_cache(cache_dir, signature):
+    """
+    Memory-maps the columns kept in cache_dir, returning None unless they were written from a log with the same
+    signature
+    """
+    try:
+        if not np.array_equal(np.load(os.path.join(cache_dir, 'signature.npy')), signature):
+            return None
+        return LogColumns(dict((name, np.load(os.path.join(cache_dir, name + '.npy'), mmap_mode='r'))
+                               for name in column_names))
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def parse_cells(cells, unit):
+    """
+    Converts the cells of the time, speed, battery, roll, pitch, motor temperature and odometer columns, in that
+    order, into a dictionary of arrays
+    """
+    return {
+        'time': parse_millisecond_time_column(cells[0]),
+        'speed': parse_speed(parse_float_column(cells[1]), unit),
+        'battery': parse_float_column(cells[2]),
+        'roll': parse_angle(parse_float_column(cells[3]), invert=True),
+        'pitch': parse_angle(parse_float_column(cells[4])),
+        'motor_temp': parse_temperature(parse_float_column(cells[5]), unit),
+        'distance': parse_distance(parse_float_column(cells[6]), unit)
+    }
+
+
+def take_rows(columns, start, stop):
+    return dict((name, columns[name][start:stop]) for name in column_names)
+
+
+def slice_window(data, start_us, end_us):
+    """
+    Keeps the rows of data between start_us and end_us, in microseconds since the unix epoch, plus one guard row on
+    each side
+    """
+    first = max(np.searchsorted(data.time, start_us, side='left') - 1, 0)
+    last = len(data)
+    if end_us is not None:
+        last = min(np.searchsorted(data.time, end_us, side='right') + 1, len(data))
+    # copy so the rest of the log can be freed
+    return LogColumns(dict((name, data[name][first:last].copy()) for name in column_names))
+
+
+def to_epoch_us(date):
+    """
+    Converts a datetime to microseconds since the unix epoch
+    """
+    delta = date - epoch
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+
+def parse_float_column(cells):
+    """
+    Converts a list of cells to a float64 array, with NaN for the cells that are not numbers
+    """
+    try:
+        return np.array(cells, dtype=np.float64)
+    except ValueError:
+        column = np.empty(len(cells), dtype=np.float64)
+        for i, cell in enumerate(cells):
+            try:
+                column[i] = float(cell)
+            except ValueError:
+                column[i] = np.nan
+        return column
+
+
+def parse_millisecond_time_column(time_strs):
+    """
+    Parses a list of timestamp strings in the format yyyy-MM-dd'T'HH:mm:ss.SSSZ to int64 microseconds since the unix
+    epoch. The digits are read at fixed offsets for the whole column at once and the timezone is ignored, just like in
+    parse_millisecond_time. If any timestamp does not have digits and separators where the format puts them, the column
+    is parsed one timestamp at a time by parse_millisecond_time instead, which raises ValueError on the ones it cannot
+    read
+    """
+    if len(time_strs) == 0:
+        return np.zeros(0, dtype=np.int64)
+    chars = np.array(time_strs, dtype='S23').view(np.uint8).reshape(-1, 23)
+    if not (np.all(chars[:, separator_offsets] == separators) and
+            np.all((chars[:, digit_offsets] >= ord('0')) & (chars[:, digit_offsets] <= ord('9')))):
+        return np.array([to_epoch_us(parse_millisecond_time(time_str)) for time_str in time_strs], dtype=np.int64)
+    chars = chars.astype(np.int64) - ord('0')
+
+    def field(start, stop):
+        return chars[:, start:stop].dot(10 ** np.arange(stop - start - 1, -1, -1))
+
+    months = (field(0, 4) - 1970) * 12 + field(5, 7) - 1
+    days = months.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64) + field(8, 10) - 1
+    seconds = days * 86400 + field(11, 13) * 3600 + field(14, 16) * 60 + field(17, 19)
+    return seconds * 1000000 + field(20, 23) * 1000
+
+
+def to_float(value):
+    """
+    Converts either a single cell or a whole float64 column to floating point
+    """
+    if isinstance(value, np.ndarray):
+        return value
+    return float(value)
+
+
 def parse_distance(original, unit):
     """
     Converts the original distance to the desired unit system
@@ -35,7 +345,7 @@ def parse_distance(original, unit):
     """
     if unit[0] == unit[1]:
         try:
-            return float(original)
+            return to_float(original)
         except ValueError:
             return None
     if unit[1] == 'm':  # imperial to metric
@@ -61,6 +371,13 @@ def parse_millisecond_time(time_str):
     return datetime.strptime(time_str, '%Y-%m-%dT%H:%M:%S.%f')
 
 
+def format_millisecond_time(date):
+    """
+    Formats a datetime as a timestamp string that parse_millisecond_time reads back, with a UTC timezone suffix
+    """
+    return '{}{:03d}+0000'.format(date.strftime('%Y-%m-%dT%H:%M:%S.'), date.microsecond // 1000)
+
+
 def parse_battery(charge):
     """
     Parses the battery value to an integer
@@ -76,7 +393,7 @@ def parse_angle(angle_text, invert=False):
     Converts the original angle to values between -180 and 180, with 0 being horizontal
     """
     try:
-        angle = float(angle_text) / 10 - 180
+        angle = to_float(angle_text) / 10 - 180
         if invert:
             angle = -angle
         return angle
@@ -90,7 +407,7 @@ def parse_temperature(original, unit):
     """
     if unit[0] == unit[1]:
         try:
-            return float(original)
+            return to_float(original)
         except ValueError:
             return None
     if unit[1] == 'm':  # imperial to metric
@@ -104,7 +421,7 @@ def mile_to_km(mile):
     Converts Miles to Kilometers
     """
     try:
-        return float(mile) * 1.609344
+        return to_float(mile) * 1.609344
     except ValueError:
         return None
 
@@ -114,7 +431,7 @@ def km_to_mile(km):
     Converts Kilometers to Miles
     """
     try:
-        return float(km) / 1.609344
+        return to_float(km) / 1.609344
     except ValueError:
         return None
 
@@ -124,7 +441,7 @@ def f_to_c(f_temp):
     Converts from Farenheint to Celsius
     """
     try:
-        return (float(f_temp) - 32.0) * 5.0 / 9.0
+        return (to_float(f_temp) - 32.0) * 5.0 / 9.0
     except ValueError:
         return None
 
@@ -134,6 +451,6 @@ def c_to_f(c_temp):
     Converts from Celsius to Farenheint
     """
     try:
-        return (float(c_temp) * 9.0 / 5.0) + 32.0
+        return (to_float(c_temp) * 9.0 / 5.0) + 32.0
     except ValueError:
         return None
@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
-from datetime import timedelta
-import tqdm
-from moviepy.editor import *
-from IconManager import IconManager
+# moviepy, tqdm and the modules depending on them take seconds to import, so they are only imported by the stages that
+# need them. This keeps -h and --plan fast
+from datetime import datetime, timedelta
+from HudRenderer import HudRenderer, hud_layout
+from IconAtlas import IconAtlas, default_steps
+from GlyphCache import GlyphCache, default_cache_dir
 import LogParser
+import Telemetry
+from Instrumentation import Instrumentation, profiled
+
+render_fps = 60
+
+# padding and font size of the icons at full scale, scaled down with the rest of the picture by draft renders
+icon_padding = 10
+icon_fontsize = 50
+
+# fraction of the resolution, frame rate and x264 preset of --draft renders
+draft_scale = 0.5
+draft_fps = 15
+draft_preset = 'ultrafast'
 
 resolution_map = {
     '1080': {
@@ -19,39 +34,341 @@ resolution_map = {
 
 class OnewheelHudVideo:
     def __init__(self, data_path, footage_path, orientation='portrait', resolution='1080', start_second=0,
-                 start_date=None, end_second=None, unit='mm', out_path='onewheel.MP4'):
+                 start_date=None, end_second=None, unit='mm', out_path='onewheel.MP4', hud_renderer='stream',
+                 atlas_budget=64, glyph_cache_dir=default_cache_dir, glyph_cache_size=512, backend='moviepy',
+                 text_engine='pillow', rotation_step=0, fast_decode=False, report_path=None, profile_path=None,
+                 clip_cache_size=0, quantize_steps=None, hysteresis=0.0, smoothing=None, smoothing_window=5,
+                 queue_size=8, scale=1.0, fps=render_fps, preset=None, stride=1, render_window=None):
         self.footage_path = footage_path
+        self.report_path = report_path
+        self.profile_path = profile_path
+        self.instrumentation = Instrumentation(enabled=report_path is not None)
         self.orientation = orientation
-        self.resolutions = compute_resolutions(orientation, resolution)
+        self.resolutions = compute_resolutions(orientation, resolution, scale)
         self.start_second = start_second
         self.end_second = end_second
-        self.icon_manager = IconManager(resolution=res_2_tuple(self.resolutions['icon']),
-                                        unit='metric' if unit[1] == 'm' else 'imperial')
-        self.data = LogParser.parse(data_path, unit)
-        self.start_date = LogParser.parse_millisecond_time(start_date)
+        self.fps = fps
+        self.preset = preset
+        # every stride-th frame is rendered, making a silent time-lapse
+        self.stride = stride
+        # (start_second, end_second) of the whole video when this one is a segment of it
+        self.render_window = render_window
+        self.quantize_steps = dict(default_steps)
+        if quantize_steps is not None:
+            self.quantize_steps.update(quantize_steps)
+        self.hysteresis = hysteresis
+        self.smoothing = smoothing
+        self.smoothing_window = smoothing_window
+        # the IconManager is only created by load_icon_manager once rendering starts
+        self.icon_manager_kwargs = {
+            'resolution': res_2_tuple(self.resolutions['icon']),
+            'padding': int(round(icon_padding * scale)),
+            'fontsize': int(round(icon_fontsize * scale)),
+            'unit': 'metric' if unit[1] == 'm' else 'imperial',
+            'text_engine': text_engine,
+            'rotation_step': rotation_step,
+            'clip_cache_bytes': clip_cache_size * 1024 * 1024 or None
+        }
+        self.icon_manager = None
+        if isinstance(start_date, datetime):
+            self.start_date = start_date
+        else:
+            self.start_date = LogParser.parse_millisecond_time(start_date)
+        with self.instrumentation.stage('parse'):
+            self.data = LogParser.parse_columns(data_path, unit, window=self.compute_log_window())
         self.out_path = out_path
+        self.hud_renderer = hud_renderer
+        self.atlas_budget = atlas_budget
+        self.glyph_cache_dir = glyph_cache_dir
+        self.glyph_cache_size = glyph_cache_size
+        self.backend = backend
+        self.fast_decode = fast_decode
+        self.queue_size = queue_size
+        self.hud = None
 
         print 'Footage is coming from', self.footage_path
         print 'Footage orientation is', self.orientation
         print 'Resolutions are:'
         print self.resolutions
 
+    def compute_log_window(self):
+        """
+        Returns the (start, end) dates of the log the rendered clip needs, with end being None when the clip runs until
+        the end of the footage
+        """
+        start_second, end_second = self.compute_stabilized_window()
+        start_date = self.start_date + timedelta(seconds=start_second - self.start_second)
+        end_date = None
+        if end_second is not None:
+            end_date = self.start_date + timedelta(seconds=end_second - self.start_second)
+        return start_date, end_date
+
+    def compute_stabilized_window(self):
+        """
+        Returns the (start_second, end_second) of the footage whose values are smoothed and quantized together. The
+        smoothing and the hysteresis carry state from frame to frame, so a segment of a video runs them over the whole
+        video to show the same values as a single render would
+        """
+        if self.render_window is None or (self.smoothing is None and not self.hysteresis):
+            return self.start_second, self.end_second
+        return self.render_window
+
+    def load_icon_manager(self):
+        """
+        Creates the IconManager, unless one was already set, and returns it
+        """
+        if self.icon_manager is None:
+            from IconManager import IconManager
+            self.icon_manager = IconManager(**self.icon_manager_kwargs)
+        return self.icon_manager
+
+    def plan(self):
+        """
+        Prints the time window of the footage and of the log that would be rendered, and how many frames that makes,
+        without touching the footage
+        """
+        start_date, end_date = self.compute_log_window()
+        print 'Footage from second', self.start_second, 'to', \
+            'the end of the footage' if self.end_second is None else self.end_second
+        print 'Log from', start_date, 'to', 'the end of the log' if end_date is None else end_date
+        print 'Log rows in window:', len(self.data)
+        if len(self.data) > 0:
+            print 'Log rows span', self.data.row(0)['time'], 'to', self.data.row(len(self.data) - 1)['time']
+        print 'Output resolution {}x{} at {} fps'.format(self.resolutions['footage']['w'],
+                                                        self.resolutions['footage']['h'], self.fps)
+        if self.end_second is not None:
+            duration = float(self.end_second - self.start_second) / self.stride
+            print 'Frames to render: {} ({:.1f}s at {} fps)'.format(Telemetry.count_frames(duration, self.fps),
+                                                                    duration, self.fps)
+        else:
+            print 'Frames to render depend on the length of the footage, pass --end-second to know them'
+
     def render(self):
+        self.load_icon_manager()
+        if self.backend == 'ffmpeg':
+            self.render_ffmpeg_overlay()
+        elif self.backend == 'pipeline':
+            self.render_pipeline()
+        else:
+            self.render_moviepy()
+        self.print_hud_change_rates()
+        self.write_report()
+
+    def render_moviepy(self):
+        instrumentation = self.instrumentation
+
         print 'Generating footage clip...'
-        footage_clip = self.generate_footage_clip()
+        with instrumentation.stage('footage_clip'):
+            footage_clip = self.generate_footage_clip()
 
         print 'Generating info clip...'
-        info_clip = self.generate_fps_info_clip(footage_clip, self.start_date)
+        with instrumentation.stage('info_clip'):
+            info_clip = self.generate_hud_clip(footage_clip)
 
         print 'Generating final clip...'
-        final_clip = CompositeVideoClip([footage_clip, info_clip.set_position('bottom', 'center')])
+        with instrumentation.stage('composite'):
+            final_clip = self.composite_clips(footage_clip, info_clip)
+            if instrumentation.enabled:
+                timed_get_frame = instrumentation.timed_frames('frame', final_clip.get_frame)
+                final_clip = final_clip.fl(lambda get_frame, t: timed_get_frame(t))
 
         print 'Rendering...'
-        final_clip.write_videofile(self.out_path, fps=60, threads=8)
+        with instrumentation.stage('encode'), profiled(self.profile_path):
+            final_clip.write_videofile(self.out_path, fps=self.fps, threads=8, preset=self.preset or 'medium')
         # final_clip.preview(fps=60, audio=False)
         # final_clip.save_frame(filename="frame.png", t=10.669)
 
+    def generate_hud_clip(self, footage_clip):
+        """
+        Generates the info clip with the selected HUD renderer
+        """
+        if self.hud_renderer == 'stream':
+            return self.generate_info_clip(footage_clip, self.start_date)
+        return self.generate_fps_info_clip(footage_clip, self.start_date)
+
+    def composite_clips(self, footage_clip, info_clip):
+        if self.hud_renderer == 'stream' and self.hud is not None:
+            return self.blend_hud(footage_clip)
+
+        from moviepy.editor import CompositeVideoClip
+        # the HUD goes along the bottom edge in portrait and along the right edge in landscape
+        position = ('center', 'bottom') if self.orientation == 'portrait' else ('right', 'center')
+        return CompositeVideoClip([footage_clip, info_clip.set_position(position)])
+
+    def blend_hud(self, footage_clip):
+        """
+        Lays the HUD drawn by the stream renderer over every frame of the footage with a HudBlender, in place of the
+        floating point compositing of CompositeVideoClip
+        """
+        import numpy as np
+        from Blend import HudBlender
+        hud = self.hud
+        blender = HudBlender(res_2_tuple(self.resolutions['footage']), hud.size, hud.orientation)
+        # the footage readers may hand over their own buffers, so every frame is copied into this one before the HUD
+        # is blended into it. It is written out before the next frame is asked for
+        frame = np.empty((footage_clip.h, footage_clip.w, 3), dtype=np.uint8)
+
+        def blend_frame(get_frame, t):
+            np.copyto(frame, get_frame(t))
+            return blender.blend(frame, hud.render(t), hud.version)
+
+        return footage_clip.fl(blend_frame)
+
+    def generate_info_clip(self, footage, start_date):
+        """
+        Generates the info clip as a single VideoClip whose frames are drawn on demand by a HudRenderer
+        """
+        renderer = self.generate_hud_renderer(self.fps, footage.duration * self.stride, start_date)
+        return renderer.to_clip(footage.duration)
+
+    def generate_hud_renderer(self, fps, duration, start_date):
+        """
+        Builds a HudRenderer drawing the HUD of a clip with the given frame rate covering duration seconds of footage
+        """
+        disk_cache = None
+        if self.glyph_cache_dir:
+            disk_cache = GlyphCache(self.glyph_cache_dir, max_bytes=self.glyph_cache_size * 1024 * 1024)
+        atlas = IconAtlas(self.load_icon_manager(), steps=self.quantize_steps,
+                          max_bytes=self.atlas_budget * 1024 * 1024, disk_cache=disk_cache)
+        telemetry = self.resample_data(fps, duration, start_date)
+        self.hud = HudRenderer(atlas, telemetry.row_at, self.orientation,
+                               instrumentation=self.instrumentation if self.instrumentation.enabled else None)
+        return self.hud
+
+    def resample_data(self, fps, duration, start_date):
+        """
+        Interpolates the log at every frame of a clip with the given frame rate covering duration seconds of footage,
+        then smooths and quantizes the values shown on the HUD
+        """
+        columns = Telemetry.to_columns(self.data)
+        steps = dict((column, self.quantize_steps[metric]) for metric, column in hud_layout)
+        window_start, window_end = self.compute_stabilized_window()
+        if (window_start, window_end) == (self.start_second, self.end_second):
+            telemetry = Telemetry.resample(columns, start_date, fps, duration, self.stride)
+            telemetry.stabilize(steps, self.hysteresis, self.smoothing, self.smoothing_window)
+            return telemetry
+
+        # the whole video is stabilized and the frames of this segment are taken out of it
+        offset = self.start_second - window_start
+        telemetry = Telemetry.resample(columns, start_date - timedelta(seconds=offset), fps, window_end - window_start,
+                                       self.stride)
+        telemetry.stabilize(steps, self.hysteresis, self.smoothing, self.smoothing_window)
+        first = int(round(offset * fps / self.stride))
+        return telemetry.take(first, first + Telemetry.count_frames(float(duration) / self.stride, fps))
+
+    def render_ffmpeg_overlay(self):
+        """
+        Renders the video letting ffmpeg decode, scale, rotate and overlay the footage natively. Only the HUD bar is
+        drawn in Python and piped to ffmpeg as raw RGBA frames
+        """
+        import FfmpegOverlay
+        duration = self.compute_duration()
+
+        print 'Generating HUD renderer...'
+        with self.instrumentation.stage('hud_renderer'):
+            renderer = self.generate_hud_renderer(self.fps, duration, self.start_date)
+
+        print 'Rendering...'
+        with self.instrumentation.stage('encode'), profiled(self.profile_path):
+            FfmpegOverlay.render_overlay(self.footage_path, self.out_path, renderer, self.start_second, duration,
+                                         self.fps, footage_size(self.resolutions, self.orientation),
+                                         transpose=self.orientation == 'portrait', preset=self.preset,
+                                         speed=self.stride)
+
+    def render_pipeline(self):
+        """
+        Renders the video with footage decoding, HUD drawing and encoding running at the same time in their own threads,
+        see PipelineRender
+        """
+        import PipelineRender
+        duration = self.compute_duration()
+
+        print 'Generating HUD renderer...'
+        with self.instrumentation.stage('hud_renderer'):
+            renderer = self.generate_hud_renderer(self.fps, duration, self.start_date)
+        reader = self.generate_footage_reader(duration)
+        size = res_2_tuple(self.resolutions['footage'])
+        command = PipelineRender.build_encode_command(self.footage_path, self.out_path, (size[1], size[0]), self.fps,
+                                                      self.start_second, duration, self.preset,
+                                                      audio=self.stride == 1)
+        pipeline = PipelineRender.PipelineRender(reader, renderer, command, self.queue_size)
+
+        print 'Rendering...'
+        with self.instrumentation.stage('encode'), profiled(self.profile_path):
+            pipeline.run()
+
+        report = pipeline.report()
+        self.instrumentation.add_section('pipeline', report)
+        print 'Pipeline stages:'
+        for name, stats in report.items():
+            print '  {}: {:.1f}s busy, {:.1f}s waiting for input, {:.1f}s waiting for output, ' \
+                  '{:.1f} frames queued on average'.format(name, stats['busy_seconds'], stats['waiting_input_seconds'],
+                                                           stats['waiting_output_seconds'], stats['mean_input_depth'])
+        print 'Slowest stage:', max(report, key=lambda name: report[name]['busy_seconds'])
+
+    def generate_footage_reader(self, duration):
+        """
+        Builds a FootageReader handing over duration seconds of footage at the final frame rate, size and orientation
+        """
+        from FootageReader import FootageReader
+        return FootageReader(self.footage_path, self.start_second, duration,
+                             footage_size(self.resolutions, self.orientation), self.fps,
+                             transpose=self.orientation == 'portrait', speed=self.stride)
+
+    def compute_duration(self):
+        """
+        Returns the length in seconds of the rendered clip, probing the footage if it runs until its end
+        """
+        from FootageReader import probe_footage
+        end_second = self.end_second
+        if end_second is None:
+            end_second = probe_footage(self.footage_path)['duration']
+        return end_second - self.start_second
+
+    def render_live(self, sink_target, frame_budget=None):
+        """
+        Plays the video in real time to sink_target, '-' for raw RGB frames on the standard output or a file or URL
+        for ffmpeg to encode to. The HUD is drawn on demand and held or dropped when it cannot keep up, see LivePreview
+        """
+        import LivePreview
+        duration = self.compute_duration()
+
+        renderer = self.generate_hud_renderer(self.fps, duration, self.start_date)
+        reader = self.generate_footage_reader(duration)
+        size = res_2_tuple(self.resolutions['footage'])
+        sink = LivePreview.open_sink(sink_target, (size[1], size[0]), self.fps)
+        print 'Playing live to', sink_target, '...'
+        LivePreview.LivePreview(reader, renderer, sink, self.fps, frame_budget).play()
+
+    def print_hud_change_rates(self):
+        """
+        Prints how often each HUD icon had to be redrawn by the stream renderer
+        """
+        if self.hud is None:
+            return
+        print 'HUD icons redrawn in', self.hud.frame_count, 'frames:'
+        for metric, rate in sorted(self.hud.change_rates().items()):
+            print '  {}: {:.1%}'.format(metric, rate)
+
+    def write_report(self):
+        """
+        Writes the instrumentation report, with the icon cache statistics, if one was requested
+        """
+        if self.report_path is None:
+            return
+        self.instrumentation.add_section('icon_cache', self.icon_manager.cache_stats)
+        if self.hud is not None:
+            self.instrumentation.add_section('atlas', self.hud.atlas.stats)
+            self.instrumentation.add_section('hud_change_rates', self.hud.change_rates())
+        self.instrumentation.write_report(self.report_path)
+        print 'Instrumentation report written to', self.report_path
+
     def generate_fps_info_clip(self, footage, start_date):
+        """
+        Generates the info clip out of the IconManager's cached clips. Consecutive frames showing the same cached clip
+        are merged into a single run, so the number of clips grows with the number of value changes, not of frames
+        """
+        import tqdm
         icon_clips = {
             'speed': [],
             'pitch': [],
@@ -60,45 +377,48 @@ class OnewheelHudVideo:
             'temperature': []
         }
 
-        frame_duration = 1.0/footage.fps
-        last_id = 0
-        for t in tqdm.tqdm(f_range(0, footage.duration, frame_duration)):
-            row, last_id = interpolate_from_data(self.data, timedelta(seconds=t), start_date, last_id)
-
-            icon_clips['speed'].append(self.icon_manager.get_animated_speed_icon_clip(speed=row['speed'],
-                                                                             duration=frame_duration))
-            icon_clips['pitch'].append(self.icon_manager.get_pitch_icon_clip(angle=row['pitch'],
-                                                                             duration=frame_duration))
-            icon_clips['roll'].append(self.icon_manager.get_roll_icon_clip(angle=row['roll'],
-                                                                           duration=frame_duration))
-            icon_clips['battery'].append(self.icon_manager.get_battery_icon_clip(charge=row['battery'],
-                                                                                 duration=frame_duration))
-            icon_clips['temperature'].append(self.icon_manager.get_temperature_icon_clip(temperature=row['motor_temp'],
-                                                                                         duration=frame_duration))
-        print 'Combining icons...'
-        info_clip = self.combine_info_clips(icon_clips)
+        frame_duration = 1.0/self.fps
+        telemetry = self.resample_data(self.fps, footage.duration * self.stride, start_date)
+        im = self.load_icon_manager()
+        for i in tqdm.tqdm(range(telemetry.n_frames)):
+            row = telemetry.row(i)
+
+            append_run(icon_clips['speed'], im.get_animated_speed_icon_clip(speed=row['speed'],
+                                                                            duration=frame_duration), frame_duration)
+            append_run(icon_clips['pitch'], im.get_pitch_icon_clip(angle=row['pitch'],
+                                                                   duration=frame_duration), frame_duration)
+            append_run(icon_clips['roll'], im.get_roll_icon_clip(angle=row['roll'],
+                                                                 duration=frame_duration), frame_duration)
+            append_run(icon_clips['battery'], im.get_battery_icon_clip(charge=row['battery'],
+                                                                       duration=frame_duration), frame_duration)
+            append_run(icon_clips['temperature'], im.get_temperature_icon_clip(temperature=row['motor_temp'],
+                                                                               duration=frame_duration), frame_duration)
+        print 'Combining', sum(len(runs) for runs in icon_clips.values()), 'icon runs...'
+        with self.instrumentation.stage('concatenate'):
+            info_clip = self.combine_info_clips(icon_clips)
         return info_clip
 
     def compute_log_delay(self, i):
-        delta_t = self.data[i + 1]['time'] - self.data[i]['time']
-        delta_seconds = delta_t.seconds + delta_t.microseconds * 1e-6
-        return delta_seconds
+        return (self.data.time[i + 1] - self.data.time[i]) * 1e-6
 
     def generate_time_clip(self):
+        import tqdm
+        from moviepy.editor import TextClip, concatenate_videoclips
         time_clips = []
-        for row in tqdm.tqdm(self.data[:300]):
+        for row in tqdm.tqdm([self.data.row(i) for i in range(min(300, len(self.data)))]):
             time_str = '{}'.format(row['time'])
             time_clips.append(TextClip(time_str, fontsize=64, color='red').set_duration(self.avg_log_delay))
         return concatenate_videoclips(time_clips)
 
     def combine_info_clips(self, icon_clips):
+        from moviepy.editor import clips_array
         # combine clips by info
         full_icon_clips = [
-            concatenate_videoclips(icon_clips['speed']),
-            concatenate_videoclips(icon_clips['pitch']),
-            concatenate_videoclips(icon_clips['roll']),
-            concatenate_videoclips(icon_clips['battery']),
-            concatenate_videoclips(icon_clips['temperature'])
+            concatenate_runs(icon_clips['speed']),
+            concatenate_runs(icon_clips['pitch']),
+            concatenate_runs(icon_clips['roll']),
+            concatenate_runs(icon_clips['battery']),
+            concatenate_runs(icon_clips['temperature'])
         ]
 
         # combine info clips into a bar
@@ -120,19 +440,53 @@ class OnewheelHudVideo:
             raise Exception("Orientation not set")
 
     def generate_footage_clip(self):
+        if self.fast_decode:
+            return self.generate_piped_footage_clip()
+
+        from moviepy.editor import VideoFileClip
         footage_clip = (VideoFileClip(self.footage_path)
                         .resize(res_2_tuple(self.resolutions['footage'])))
 
         footage_clip = footage_clip.subclip(t_start=self.start_second, t_end=self.end_second)
+        if self.stride > 1:
+            footage_clip = footage_clip.without_audio().speedx(self.stride)
 
         if self.orientation == 'portrait':
             footage_clip = footage_clip.rotate(-90)
 
         return footage_clip
 
+    def generate_piped_footage_clip(self):
+        """
+        Generates the footage clip out of a FootageReader, so that ffmpeg seeks, scales and rotates the footage before
+        it reaches Python
+        """
+        from moviepy.editor import AudioFileClip, VideoClip
+        from FootageReader import probe_footage
+        infos = probe_footage(self.footage_path)
+        end_second = self.end_second
+        if end_second is None:
+            end_second = infos['duration']
+        duration = end_second - self.start_second
+
+        reader = self.generate_footage_reader(duration)
+        footage_clip = VideoClip(make_frame=reader.get_frame, duration=float(duration) / self.stride)
+        footage_clip.fps = self.fps
+
+        if infos['audio_found'] and self.stride == 1:
+            footage_clip = footage_clip.set_audio(AudioFileClip(self.footage_path).subclip(self.start_second,
+                                                                                           end_second))
+        return footage_clip
 
-def compute_resolutions(orientation, resolution_name):
+
+def compute_resolutions(orientation, resolution_name, scale=1.0):
     resolution = resolution_map[resolution_name][orientation]
+    if scale != 1.0:
+        # scaled to the nearest multiple of 10, which the encoder accepts and the icons split into evenly
+        resolution = {
+            'w': int(round(resolution['w'] * scale / 10.0)) * 10,
+            'h': int(round(resolution['h'] * scale / 10.0)) * 10
+        }
     resolutions = {}
     n_icons = 5
 
@@ -155,36 +509,20 @@ def compute_resolutions(orientation, resolution_name):
     return resolutions
 
 
-def interpolate_from_data(data, delta_t, start_date, last_id=0):
-    # find between which rows is t in
-    t = delta_t + start_date
-    id_1 = None
-    id_2 = None
-    for i, row in enumerate(data[last_id:]):
-        if row['time'] >= t:
-            id_2 = i + last_id
-            id_1 = id_2 - 1
-            break
-
-    # find interpolation offset x
-    d1 = data[id_1]['time']
-    d2 = data[id_2]['time']
-    x = (t - d1).total_seconds() / (d2 - d1).total_seconds()
-
-    # use x offset to interpolate attributes
-    row = {'time': t}
-    r1 = data[id_1]
-    r2 = data[id_2]
-    for item in r1.items():
-        if item[0] != 'time':
-            a1 = r1[item[0]]
-            a2 = r2[item[0]]
-            if a1 is None or a2 is None:
-                row[item[0]] = None
-            else:
-                row[item[0]] = (a2 - a1) * x + a1
-
-    return row, id_2
+def append_run(runs, clip, duration):
+    """
+    Appends a clip lasting duration seconds to a list of [clip, duration] runs, extending the last run instead if it
+    shows the same clip
+    """
+    if runs and runs[-1][0] is clip:
+        runs[-1][1] += duration
+    else:
+        runs.append([clip, duration])
+
+
+def concatenate_runs(runs):
+    from moviepy.editor import concatenate_videoclips
+    return concatenate_videoclips([clip.set_duration(duration) for clip, duration in runs])
 
 
 def compute_average_delta_t(data):
@@ -198,6 +536,30 @@ def compute_average_delta_t(data):
     return sum(deltas_s) / len(deltas_s)
 
 
+def footage_size(resolutions, orientation):
+    """
+    Returns the (width, height) the original footage is scaled to before being rotated into the final orientation
+    """
+    footage = resolutions['footage']
+    if orientation == 'portrait':
+        # the footage is shot in landscape and rotated afterwards
+        return footage['h'], footage['w']
+    return footage['w'], footage['h']
+
+
+def parse_steps(text):
+    """
+    Parses quantization steps written as comma separated metric=step pairs into a dictionary
+    """
+    steps = {}
+    for pair in text.split(','):
+        metric, step = pair.split('=')
+        if metric.strip() not in default_steps:
+            raise ValueError('Unknown metric {}'.format(metric))
+        steps[metric.strip()] = float(step)
+    return steps
+
+
 def res_2_tuple(resolution):
     """
     Converts a resolution map to a tuple
@@ -226,20 +588,143 @@ if __name__ == '__main__':
                         help='Which second of the original footage should the final video start from')
     parser.add_argument('--start-date', type=str, default='0',
                         help='Timestamp at the moment of the frame on start_second')
+    parser.add_argument('--auto-sync', action='store_true',
+                        help='Finds the start date by matching the motion of the footage with the speed and pitch in '
+                             'the log instead of taking it from --start-date')
     parser.add_argument('--end-second', type=float, default=None,
                         help='Which second of the original footage the the final video end at')
     parser.add_argument('--unit', type=str, default='mm', choices=['mm', 'mi', 'im', 'ii'],
                         help='Defines input output unit conversion with two letters. The first denotes the input unit '
                              'and the second denotes the output unit.')
-    parser.add_argument('--output-file', '-o', type=str,
+    parser.add_argument('--output-file', '-o', type=str, default='onewheel.MP4',
                         help='Path the output file. If none is given a file called onewheel.MP4 will be created on the '
                              'directory the script if being run.')
+    parser.add_argument('--hud-renderer', type=str, default='stream', choices=['stream', 'clips'],
+                        help='How the HUD is generated. stream draws every frame on demand into a single clip, clips '
+                             'builds one clip per icon per frame before rendering.')
+    parser.add_argument('--atlas-budget', type=int, default=64,
+                        help='Memory in megabytes used to keep pre-rasterized icons when using the stream renderer')
+    parser.add_argument('--clip-cache-size', type=int, default=0,
+                        help='Memory in megabytes each metric may use to keep composited icon clips before the least '
+                             'recently used ones are evicted. 0 keeps every clip. The clips renderer holds on to every '
+                             'clip it shows until the video is built, so the budget does not lower its memory use.')
+    parser.add_argument('--glyph-cache', type=str, default=default_cache_dir,
+                        help='Directory where rasterized icons are kept between renders. Pass an empty string to '
+                             'disable it.')
+    parser.add_argument('--glyph-cache-size', type=int, default=512,
+                        help='Disk space in megabytes the glyph cache may use before old icons are evicted')
+    parser.add_argument('--backend', type=str, default='moviepy', choices=['moviepy', 'ffmpeg', 'pipeline'],
+                        help='What composites the HUD over the footage. moviepy brings every frame into Python, ffmpeg '
+                             'decodes, scales and overlays the footage natively and only receives the HUD from Python, '
+                             'pipeline decodes, blends and encodes in three concurrent threads.')
+    parser.add_argument('--queue-size', type=int, default=8,
+                        help='Frames that may wait between two stages of the pipeline backend')
+    parser.add_argument('--text-engine', type=str, default='pillow', choices=['pillow', 'imagemagick'],
+                        help='What draws the text on the icons. pillow renders it in process, imagemagick spawns '
+                             'ImageMagick for every new label.')
+    parser.add_argument('--rotation-step', type=float, default=0,
+                        help='Precomputes every rotation of the roll, pitch and speed pointer icons at this angular '
+                             'step in degrees, trading memory for speed. 0 rotates each new angle on demand.')
+    parser.add_argument('--quantize', type=parse_steps, default=None,
+                        help='Comma separated metric=step pairs overriding how finely each metric is shown, for '
+                             'example roll=1,pitch=1. The metrics are speed, pitch, roll, battery and temperature.')
+    parser.add_argument('--hysteresis', type=float, default=0.0,
+                        help='Fraction of a quantization step a value must move past the halfway point before the '
+                             'shown value changes. Stops noisy readings from flickering between two values.')
+    parser.add_argument('--smoothing', type=str, default=None, choices=['ema', 'median'],
+                        help='Smooths the interpolated values with an exponential moving average or a running median '
+                             'before they are quantized')
+    parser.add_argument('--smoothing-window', type=int, default=5,
+                        help='Number of frames the smoothing spans')
+    parser.add_argument('--fast-decode', action='store_true',
+                        help='Reads the footage through an ffmpeg pipe that seeks, scales and rotates it before it '
+                             'reaches Python, instead of resizing every frame in Python.')
+    parser.add_argument('--report', type=str, default=None,
+                        help='Writes a JSON report with the time and memory taken by each stage, the icon cache '
+                             'statistics and a histogram of the time taken to produce each frame to this path.')
+    parser.add_argument('--profile', type=str, default=None,
+                        help='Profiles the rendering loop and dumps the result to this path, with cProfile or, if the '
+                             'path ends in .html, with pyinstrument.')
+    parser.add_argument('--segments', type=int, default=1,
+                        help='Splits the video in this many time segments that are rendered in parallel processes and '
+                             'joined without re-encoding')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes rendering segments or chunks at the same time. Defaults to the '
+                             'number of CPUs.')
+    parser.add_argument('--chunk-seconds', type=float, default=None,
+                        help='Renders the video in chunks of this many seconds of footage, kept next to the output '
+                             'until they are joined. If the render is interrupted, running it again with the same '
+                             'arguments only renders the chunks that are missing.')
+    parser.add_argument('--live', type=str, default=None,
+                        help='Plays the ride in real time instead of rendering it, to a file or stream URL such as '
+                             'udp://127.0.0.1:1234 encoded by ffmpeg, or as raw RGB frames on the standard output if '
+                             '- is given.')
+    parser.add_argument('--frame-budget', type=float, default=None,
+                        help='Milliseconds a live frame may run late. Later frames are dropped and the HUD is held '
+                             'when redrawing it would not fit. Defaults to one frame.')
+    parser.add_argument('--draft', action='store_true',
+                        help='Renders a quick preview to check the sync and the layout, at a fraction of the '
+                             'resolution, a lower frame rate and with the fastest encoder preset')
+    parser.add_argument('--draft-scale', type=float, default=draft_scale,
+                        help='Fraction of the full resolution of --draft renders')
+    parser.add_argument('--draft-fps', type=int, default=draft_fps, help='Frame rate of --draft renders')
+    parser.add_argument('--stride', type=int, default=1,
+                        help='Renders only every this many frames, making a silent time-lapse that many times shorter '
+                             'than the ride')
+    parser.add_argument('--plan', '--dry-run', action='store_true',
+                        help='Parses the log and prints the time window and number of frames that would be rendered, '
+                             'without touching the footage')
     args = parser.parse_args()
-    onewheel_video = OnewheelHudVideo(args.log_file,
-                                      args.video_file,
-                                      start_second=args.start_second,
-                                      start_date=args.start_date,
-                                      end_second=args.end_second,
-                                      unit=args.unit,
-                                      out_path=args.output_file)
-    onewheel_video.render()
+    if args.live == '-':
+        import LivePreview
+        LivePreview.claim_stdout()
+    start_date = args.start_date
+    if args.auto_sync:
+        import AutoSync
+        sync = AutoSync.find_start_date(args.log_file, args.video_file, args.unit, args.start_second)
+        start_date = sync['start_date']
+        print 'Footage starts {:.1f}s into the log, correlation {:.2f}, confidence {:.0%}'.format(
+            sync['offset'], sync['correlation'], sync['confidence'])
+        print 'Using --start-date', LogParser.format_millisecond_time(start_date)
+    video_kwargs = {
+        'data_path': args.log_file,
+        'footage_path': args.video_file,
+        'start_second': args.start_second,
+        'start_date': start_date,
+        'end_second': args.end_second,
+        'unit': args.unit,
+        'out_path': args.output_file,
+        'hud_renderer': args.hud_renderer,
+        'atlas_budget': args.atlas_budget,
+        'clip_cache_size': args.clip_cache_size,
+        'quantize_steps': args.quantize,
+        'hysteresis': args.hysteresis,
+        'smoothing': args.smoothing,
+        'smoothing_window': args.smoothing_window,
+        'glyph_cache_dir': args.glyph_cache,
+        'glyph_cache_size': args.glyph_cache_size,
+        'backend': args.backend,
+        'queue_size': args.queue_size,
+        'text_engine': args.text_engine,
+        'rotation_step': args.rotation_step,
+        'fast_decode': args.fast_decode,
+        'report_path': args.report,
+        'profile_path': args.profile,
+        'stride': args.stride
+    }
+    if args.draft:
+        video_kwargs.update(scale=args.draft_scale, fps=args.draft_fps, preset=draft_preset)
+    if args.plan:
+        OnewheelHudVideo(**video_kwargs).plan()
+    elif args.live is not None:
+        frame_budget = args.frame_budget / 1000.0 if args.frame_budget is not None else None
+        OnewheelHudVideo(**video_kwargs).render_live(args.live, frame_budget)
+    elif args.chunk_seconds:
+        import CheckpointRender
+        CheckpointRender.render_checkpointed(video_kwargs, args.chunk_seconds, args.workers)
+    elif args.segments > 1:
+        import SegmentedRender
+        SegmentedRender.render_segmented(video_kwargs, args.segments, args.workers)
+    else:
+        onewheel_video = OnewheelHudVideo(**video_kwargs)
+        onewheel_video.render()
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+import Queue
+import subprocess
+import threading
+import time
+import numpy as np
+from Blend import HudBlender
+
+# seconds a blocked stage waits before checking whether another stage failed
+poll_interval = 0.1
+
+
+class BufferPool:
+    """
+    Fixed set of preallocated frames handed out to, and given back by, the stages of a pipeline. Taking a frame blocks
+    while all of them are in use, which holds the decoder back when the later stages fall behind
+    """
+    def __init__(self, n_buffers, shape):
+        self.free = Queue.Queue()
+        for _ in range(n_buffers):
+            self.free.put(np.empty(shape, dtype=np.uint8))
+
+
+class StageStats:
+    """
+    Time a stage spent working and blocked on its neighbours, and the depth of its input queue each time it took a
+    frame from it. The input of the decoder is the pool of free frames
+    """
+    def __init__(self):
+        self.frames = 0
+        self.busy = 0.0
+        self.waiting_input = 0.0
+        self.waiting_output = 0.0
+        self.depth_total = 0
+        self.depth_max = 0
+
+    def record_depth(self, depth):
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def report(self):
+        return OrderedDict([
+            ('frames', self.frames),
+            ('busy_seconds', self.busy),
+            ('waiting_input_seconds', self.waiting_input),
+            ('waiting_output_seconds', self.waiting_output),
+            ('mean_input_depth', float(self.depth_total) / max(self.frames, 1)),
+            ('max_input_depth', self.depth_max)
+        ])
+
+
+class PipelineRender:
+    """
+    Renders the video as three threads connected by bounded queues: one decodes the footage with a FootageReader into
+    frames from a BufferPool, one draws the HUD with a HudRenderer and blends it into each frame, and one writes the
+    frames to an ffmpeg encoder before giving them back to the pool. Decoding, blending and encoding release the GIL
+    for most of their work, so the three overlap. A full queue or an empty pool blocks the stage feeding it
+    """
+    def __init__(self, reader, renderer, encode_command, queue_size=8):
+        self.reader = reader
+        self.renderer = renderer
+        self.encode_command = encode_command
+        shape = reader.buffers[0].shape
+        # every queue can be full while each stage holds one more frame
+        self.pool = BufferPool(2 * queue_size + 3, shape)
+        self.decoded = Queue.Queue(maxsize=queue_size)
+        self.composited = Queue.Queue(maxsize=queue_size)
+        self.stats = OrderedDict((name, StageStats()) for name in ['decode', 'hud', 'encode'])
+        self.failed = threading.Event()
+        self.error = None
+
+    def run(self):
+        """
+        Runs the pipeline until every frame has been encoded, raising the first error any stage ran into
+        """
+        encoder = subprocess.Popen(self.encode_command, stdin=subprocess.PIPE)
+        threads = [threading.Thread(target=self.run_stage, args=(stage,))
+                   for stage in [self.decode, self.draw, lambda: self.encode(encoder)]]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(poll_interval)
+
+        if encoder.stdin and not encoder.stdin.closed:
+            encoder.stdin.close()
+        encoder.wait()
+        self.reader.close()
+        if self.error is not None:
+            raise self.error
+        if encoder.returncode != 0:
+            raise Exception('ffmpeg failed with exit code {}'.format(encoder.returncode))
+
+    def run_stage(self, stage):
+        try:
+            stage()
+        except Exception as e:
+            if self.error is None:
+                self.error = e
+            self.failed.set()
+
+    def take(self, source, stats):
+        """
+        Takes the next item from a queue, keeping track of the time spent waiting for it
+        """
+        start = time.time()
+        stats.record_depth(source.qsize())
+        while True:
+            try:
+                item = source.get(timeout=poll_interval)
+                break
+            except Queue.Empty:
+                if self.failed.is_set():
+                    raise Exception('Pipeline stopped')
+        stats.waiting_input += time.time() - start
+        return item
+
+    def send(self, target, item, stats):
+        """
+        Puts an item on a bounded queue, keeping track of the time spent waiting for room
+        """
+        start = time.time()
+        while True:
+            try:
+                target.put(item, timeout=poll_interval)
+                break
+            except Queue.Full:
+                if self.failed.is_set():
+                    raise Exception('Pipeline stopped')
+        stats.waiting_output += time.time() - start
+
+    def decode(self):
+        stats = self.stats['decode']
+        self.reader.open(0)
+        for i in range(self.reader.n_frames):
+            frame = self.take(self.pool.free, stats)
+            start = time.time()
+            complete = self.reader.read_into(frame)
+            stats.busy += time.time() - start
+            if not complete:
+                # the footage ended early, the video ends with it
+                self.pool.free.put(frame)
+                break
+            stats.frames += 1
+            self.send(self.decoded, (i, frame), stats)
+        self.send(self.decoded, None, stats)
+
+    def draw(self):
+        stats = self.stats['hud']
+        blender = HudBlender(self.reader.buffers[0].shape, self.renderer.size, self.renderer.orientation)
+        while True:
+            item = self.take(self.decoded, stats)
+            if item is None:
+                break
+            i, frame = item
+            start = time.time()
+            hud = self.renderer.render(float(i) / self.reader.fps)
+            blender.blend(frame, hud, self.renderer.version)
+            stats.busy += time.time() - start
+            stats.frames += 1
+            self.send(self.composited, frame, stats)
+        self.send(self.composited, None, stats)
+
+    def encode(self, encoder):
+        stats = self.stats['encode']
+        while True:
+            frame = self.take(self.composited, stats)
+            if frame is None:
+                break
+            start = time.time()
+            encoder.stdin.write(frame.data)
+            stats.busy += time.time() - start
+            stats.frames += 1
+            self.pool.free.put(frame)
+        encoder.stdin.close()
+
+    def report(self):
+        return OrderedDict((name, stats.report()) for name, stats in self.stats.items())
+
+
+def build_encode_command(footage_path, out_path, size, fps, start_second, duration, preset=None, audio=True):
+    """
+    Builds the ffmpeg command encoding raw RGB frames of size (width, height) read from stdin, taking the audio, if
+    any and unless audio is False, from the same part of the footage
+    """
+    from moviepy.config import get_setting
+    command = [get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24', '-s', '{}x{}'.format(size[0], size[1]),
+               '-framerate', str(fps), '-i', 'pipe:0']
+    if audio:
+        command += ['-ss', str(start_second), '-t', str(duration), '-i', footage_path, '-map', '0:v', '-map', '1:a?']
+    command += ['-c:v', 'libx264', '-pix_fmt', 'yuv420p']
+    if preset is not None:
+        command += ['-preset', preset]
+    return command + ['-c:a', 'aac', '-shortest', out_path]
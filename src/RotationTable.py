@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+import multiprocessing
+import numpy as np
+from PIL import Image
+
+resample_filters = {
+    'nearest': Image.NEAREST,
+    'bilinear': Image.BILINEAR,
+    'bicubic': Image.BICUBIC
+}
+
+
+class RotationTable:
+    """
+    Every rotation of an RGBA sprite at a fixed angular step, stacked in a single uint8 array so that rotating the
+    sprite becomes an index lookup. Rotations are counterclockwise and keep the sprite size, like moviepy's rotate with
+    expand=False
+    """
+    def __init__(self, sprite, step=0.5, resample='bicubic', workers=None):
+        self.step = step
+        self.n_angles = int(round(360.0 / step))
+        self.table = np.empty((self.n_angles,) + sprite.shape, dtype=np.uint8)
+
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        if multiprocessing.current_process().daemon:
+            # pool workers, like the ones rendering segments, cannot start processes of their own
+            workers = 1
+
+        angles = [i * step for i in range(self.n_angles)]
+        if workers > 1:
+            chunk_size = int(np.ceil(len(angles) / float(workers)))
+            chunks = [angles[i:i + chunk_size] for i in range(0, len(angles), chunk_size)]
+            pool = multiprocessing.Pool(processes=len(chunks))
+            try:
+                rotated = pool.map(rotate_sprite, [(sprite, chunk, resample) for chunk in chunks])
+            finally:
+                pool.close()
+                pool.join()
+            self.table[:] = np.concatenate(rotated)
+        else:
+            self.table[:] = rotate_sprite((sprite, angles, resample))
+
+    def index(self, angle):
+        return int(round(angle / self.step)) % self.n_angles
+
+    def get(self, angle):
+        """
+        Returns the sprite rotated by the multiple of the step closest to angle, in degrees
+        """
+        return self.table[self.index(angle)]
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+
+def rotate_sprite(args):
+    """
+    Returns the sprite rotated by each of the angles, stacked in one array. Takes a single (sprite, angles, resample)
+    tuple so it can be used with Pool.map
+    """
+    sprite, angles, resample = args
+    image = Image.fromarray(sprite, 'RGBA')
+    return np.stack([np.asarray(image.rotate(angle, resample=resample_filters[resample])) for angle in angles])
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime, timedelta
+import multiprocessing
+import os
+import shutil
+import subprocess
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+import LogParser
+
+
+def render_segmented(video_kwargs, n_segments, workers=None):
+    """
+    Renders the video described by video_kwargs, the arguments of OnewheelHudVideo, as n_segments consecutive time
+    segments in parallel worker processes, and joins them into the final output without re-encoding
+    """
+    from OnewheelHudVideo import render_fps
+    fps = video_kwargs.get('fps', render_fps)
+    stride = video_kwargs.get('stride', 1)
+
+    start_second = video_kwargs.get('start_second', 0)
+    end_second = video_kwargs.get('end_second')
+    if end_second is None:
+        end_second = ffmpeg_parse_infos(video_kwargs['footage_path'])['duration']
+    start_date = video_kwargs['start_date']
+    if not isinstance(start_date, datetime):
+        start_date = LogParser.parse_millisecond_time(start_date)
+
+    out_path = video_kwargs['out_path']
+    segment_dir = out_path + '.segments'
+    if not os.path.isdir(segment_dir):
+        os.makedirs(segment_dir)
+    extension = os.path.splitext(out_path)[1]
+
+    jobs = []
+    # the segments are cut on the frames of the footage that are rendered
+    for i, (segment_start, segment_end) in enumerate(split_segments(start_second, end_second, n_segments,
+                                                                     float(fps) / stride)):
+        jobs.append(build_segment_kwargs(video_kwargs, i, segment_start, segment_end, end_second, start_date,
+                                         os.path.join(segment_dir, 'segment_{:03d}{}'.format(i, extension))))
+
+    print 'Rendering', len(jobs), 'segments...'
+    pool = multiprocessing.Pool(processes=workers or min(len(jobs), multiprocessing.cpu_count()))
+    try:
+        segment_paths = pool.map(render_segment, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    print 'Joining segments...'
+    concat_segments(segment_paths, out_path)
+    shutil.rmtree(segment_dir)
+
+
+def split_segments(start_second, end_second, n_segments, fps):
+    """
+    Splits [start_second, end_second] into n_segments (start, end) pairs that fall on frame boundaries, so that the
+    joined segments contain exactly the frames of a single render
+    """
+    n_frames = int(round((end_second - start_second) * fps))
+    n_segments = max(1, min(n_segments, n_frames))
+    bounds = [n_frames * i // n_segments for i in range(n_segments + 1)]
+    return [(start_second + float(bounds[i]) / fps, start_second + float(bounds[i + 1]) / fps)
+            for i in range(n_segments)]
+
+
+def build_segment_kwargs(video_kwargs, i, segment_start, segment_end, end_second, start_date, out_path):
+    """
+    Returns the arguments of OnewheelHudVideo rendering segment i, from segment_start to segment_end, to out_path.
+    end_second is where the whole video ends and start_date is the date of the frame at its start_second
+    """
+    segment_kwargs = dict(video_kwargs)
+    segment_kwargs['start_second'] = segment_start
+    segment_kwargs['end_second'] = segment_end
+    # so that the smoothing and the hysteresis run over the whole video
+    segment_kwargs['render_window'] = (video_kwargs.get('start_second', 0), end_second)
+    segment_kwargs['start_date'] = start_date + timedelta(seconds=segment_start - video_kwargs.get('start_second', 0))
+    segment_kwargs['out_path'] = out_path
+    for name in ['report_path', 'profile_path']:
+        if segment_kwargs.get(name):
+            # every segment reports on its own
+            root, ext = os.path.splitext(segment_kwargs[name])
+            segment_kwargs[name] = '{}.segment_{:03d}{}'.format(root, i, ext)
+    return segment_kwargs
+
+
+def render_segment(segment_kwargs):
+    """
+    Renders a single segment. Runs in a worker process, so it builds its own OnewheelHudVideo with its own
+    IconManager and footage reader
+    """
+    from OnewheelHudVideo import OnewheelHudVideo
+    OnewheelHudVideo(**segment_kwargs).render()
+    return segment_kwargs['out_path']
+
+
+def concat_segments(segment_paths, out_path):
+    """
+    Joins the segments with ffmpeg's concat demuxer, copying the streams without re-encoding them
+    """
+    list_path = out_path + '.segments.txt'
+    with open(list_path, 'w') as list_file:
+        for path in segment_paths:
+            list_file.write("file '{}'\n".format(os.path.abspath(path).replace("'", "'\\''")))
+
+    try:
+        subprocess.check_call([get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error', '-f', 'concat',
+                               '-safe', '0', '-i', list_path, '-c', 'copy', out_path])
+    finally:
+        os.remove(list_path)
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import math
+import warnings
+import numpy as np
+import LogParser
+
+# every column of a parsed log besides its timestamp
+value_columns = ['speed', 'battery', 'roll', 'pitch', 'motor_temp', 'distance']
+
+
+class TelemetryFrames:
+    """
+    Telemetry resampled at the footage frame rate. Each column holds one value per frame, with NaN where the log had
+    no reading
+    """
+    def __init__(self, columns, fps, n_frames):
+        self.columns = columns
+        self.fps = fps
+        self.n_frames = n_frames
+
+    def frame_index(self, t):
+        """
+        Returns the frame shown at time t, in seconds from the start of the footage
+        """
+        return min(max(int(round(t * self.fps)), 0), self.n_frames - 1)
+
+    def row(self, i):
+        """
+        Returns frame i as a dictionary like the rows of the parsed log, with None for missing values
+        """
+        row = {}
+        for name, column in self.columns.items():
+            value = column[i]
+            row[name] = None if math.isnan(value) else float(value)
+        return row
+
+    def row_at(self, t):
+        return self.row(self.frame_index(t))
+
+    def take(self, start, stop):
+        """
+        Returns frames start to stop as TelemetryFrames of their own
+        """
+        stop = min(stop, self.n_frames)
+        return TelemetryFrames(dict((name, column[start:stop]) for name, column in self.columns.items()), self.fps,
+                               stop - start)
+
+    def stabilize(self, steps, hysteresis=0.0, smoothing=None, window=5):
+        """
+        Smooths, if a smoothing method is given, and quantizes in place the columns named in steps, a dictionary of
+        column name to quantization step
+        """
+        for name, step in steps.items():
+            values = self.columns[name]
+            if smoothing is not None:
+                values = smooth(values, smoothing, window)
+            self.columns[name] = quantize(values, step, hysteresis)
+
+
+def to_columns(data):
+    """
+    Converts the rows of a parsed log into a dictionary of arrays: 'time' as int64 epoch microseconds and every other
+    column as float64 with NaN for missing values. Logs parsed by LogParser.parse_columns are already in this format
+    """
+    if isinstance(data, LogParser.LogColumns):
+        return data.columns
+    columns = {'time': np.array([LogParser.to_epoch_us(row['time']) for row in data], dtype=np.int64)}
+    for name in value_columns:
+        columns[name] = np.array([np.nan if row[name] is None else row[name] for row in data], dtype=np.float64)
+    return columns
+
+
+def count_frames(duration, fps):
+    return int(math.ceil(duration * fps - 1e-9))
+
+
+def resample(columns, start_date, fps, duration, speed=1):
+    """
+    Linearly interpolates every column at each frame time of a clip starting at start_date, in one vectorized pass.
+    Each frame is interpolated between the last row before it and the first row at or after it, and is NaN if either
+    of those is missing. Frames before the first row or after the last one of the log are NaN rather than extrapolated.
+    A speed above 1 makes a time-lapse: the duration seconds of the ride are played speed times faster, so consecutive
+    frames are speed / fps seconds of the log apart
+    """
+    n_frames = count_frames(float(duration) / speed, fps)
+    times = columns['time']
+    frame_times = (LogParser.to_epoch_us(start_date) +
+                   np.round(np.arange(n_frames) * (1e6 * speed / fps)).astype(np.int64))
+
+    id_2 = np.clip(np.searchsorted(times, frame_times, side='left'), 1, len(times) - 1)
+    id_1 = id_2 - 1
+    t_1 = times[id_1]
+    span = (times[id_2] - t_1).astype(np.float64)
+    x = np.where(span > 0, (frame_times - t_1) / np.where(span > 0, span, 1.0), 0.0)
+    # frames outside of the log would be extrapolated from the edge rows
+    outside = (frame_times < times[0]) | (frame_times > times[-1])
+
+    frames = {}
+    for name in value_columns:
+        a1 = columns[name][id_1]
+        a2 = columns[name][id_2]
+        frames[name] = np.where(outside, np.nan, (a2 - a1) * x + a1)
+
+    return TelemetryFrames(frames, fps, n_frames)
+
+
+def smooth(values, method, window):
+    """
+    Smooths a column with an exponential moving average spanning about window frames ('ema') or with a centered running
+    median over window frames ('median'). Missing values stay missing and do not leak into their neighbours
+    """
+    missing = np.isnan(values)
+    if method == 'ema':
+        alpha = 2.0 / (window + 1)
+        smoothed = []
+        average = None
+        for value in values.tolist():
+            if math.isnan(value):
+                average = None
+            elif average is None:
+                average = value
+            else:
+                average += alpha * (value - average)
+            smoothed.append(value if average is None else average)
+        smoothed = np.array(smoothed, dtype=np.float64)
+    elif method == 'median':
+        half = window // 2
+        padded = np.pad(values, half, mode='edge')
+        windows = np.lib.stride_tricks.as_strided(padded, shape=(len(values), window),
+                                                  strides=(padded.strides[0], padded.strides[0]))
+        with warnings.catch_warnings():
+            # windows made only of missing values are expected around gaps in the log
+            warnings.simplefilter('ignore', RuntimeWarning)
+            smoothed = np.nanmedian(windows, axis=1)
+    else:
+        raise Exception('Unknown smoothing method {}'.format(method))
+
+    smoothed[missing] = np.nan
+    return smoothed
+
+
+def quantize(values, step, hysteresis=0.0):
+    """
+    Snaps a column to multiples of step. With hysteresis, a fraction of step, a value only moves to another multiple
+    once the reading is more than half a step plus hysteresis away from the current one, so noise around a boundary
+    does not flip the value back and forth every frame
+    """
+    levels = values / step
+    if hysteresis <= 0:
+        return np.round(levels) * step
+
+    quantized = []
+    held = None
+    for level in levels.tolist():
+        if math.isnan(level):
+            held = None
+        elif held is None or abs(level - held) > 0.5 + hysteresis:
+            held = round(level)
+        quantized.append(np.nan if held is None else held)
+    return np.array(quantized, dtype=np.float64) * step
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+# characters every value label is made of
+value_chars = u'0123456789-.%'
+
+
+class TextRenderer:
+    """
+    Draws text in process with Pillow and FreeType instead of spawning ImageMagick. Each font size is loaded once and
+    every glyph is rendered once, after which labels are assembled by copying glyph arrays side by side. Strings that
+    are registered as a whole, such as units, are rendered in one piece to keep their kerning
+    """
+    def __init__(self, font='Arial', color=(0, 0, 0)):
+        self.font = font
+        self.color = color
+        self.fonts = {}
+        self.glyphs = {}
+        self.whole_strings = set()
+
+    def prerender(self, fontsize, strings=()):
+        """
+        Renders the value characters at fontsize and registers strings, like units, to be rendered in one piece
+        """
+        for char in value_chars:
+            self.glyph(char, fontsize)
+        for text in strings:
+            text = to_unicode(text)
+            self.whole_strings.add(text)
+            self.glyph(text, fontsize)
+
+    def load_font(self, fontsize):
+        fontsize = int(fontsize)
+        if fontsize not in self.fonts:
+            self.fonts[fontsize] = find_font(self.font, fontsize)
+        return self.fonts[fontsize]
+
+    def glyph(self, text, fontsize):
+        """
+        Returns text rendered in a single piece as an RGBA uint8 array as tall as the font's line height
+        """
+        key = (text, int(fontsize))
+        if key in self.glyphs:
+            return self.glyphs[key]
+
+        font = self.load_font(fontsize)
+        ascent, descent = font.getmetrics()
+        width = max(text_width(font, text), 1)
+        alpha = Image.new('L', (width, ascent + descent), 0)
+        ImageDraw.Draw(alpha).text((0, 0), text, font=font, fill=255)
+
+        glyph = np.zeros((ascent + descent, width, 4), dtype=np.uint8)
+        glyph[:, :, :3] = self.color
+        glyph[:, :, 3] = np.asarray(alpha)
+        self.glyphs[key] = glyph
+        return glyph
+
+    def render(self, text, fontsize):
+        """
+        Returns text as an RGBA uint8 array, assembled from the pre-rendered glyphs
+        """
+        text = to_unicode(text)
+        if text in self.whole_strings:
+            return self.glyph(text, fontsize)
+
+        glyphs = [self.glyph(char, fontsize) for char in text] or [self.glyph(u' ', fontsize)]
+        label = np.zeros((glyphs[0].shape[0], sum(glyph.shape[1] for glyph in glyphs), 4), dtype=np.uint8)
+        x = 0
+        for glyph in glyphs:
+            label[:, x:x + glyph.shape[1]] = glyph
+            x += glyph.shape[1]
+        return label
+
+
+def find_font(font, fontsize):
+    """
+    Loads a TrueType font by name or path, trying the usual file names before falling back to DejaVu Sans
+    """
+    for candidate in [font, font + '.ttf', font.lower() + '.ttf', 'DejaVuSans.ttf']:
+        try:
+            return ImageFont.truetype(candidate, fontsize)
+        except IOError:
+            pass
+    raise IOError('Could not find font {}'.format(font))
+
+
+def text_width(font, text):
+    if hasattr(font, 'getlength'):
+        return int(round(font.getlength(text)))
+    return font.getsize(text)[0]
+
+
+def to_unicode(text):
+    if isinstance(text, bytes):
+        return text.decode('utf-8')
+    return text
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""
+Render benchmark. Generates a synthetic pOneWheel log and test footage, times every stage of a render separately and
+writes the results to a JSON file so they can be compared between commits.
+Like the main script, it must be run from the directory it is in.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import json
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from Instrumentation import Instrumentation, peak_rss_mb
+
+# seconds OnewheelHudVideo.py -h may take to start, a warning is printed when it takes longer
+startup_budget = 1.0
+
+log_header = ['time', 'speed', 'battery', 'tilt_angle_roll', 'tilt_angle_pitch', 'motor_temp', 'odometer']
+
+
+def generate_log(path, start_date, seconds, sample_rate):
+    """
+    Writes a synthetic pOneWheel log starting at start_date, lasting seconds with sample_rate rows per second. Values
+    are in the app's imperial units and move smoothly, like a real ride
+    """
+    n_rows = int(seconds * sample_rate)
+    with open(path, 'w') as log_file:
+        log_file.write(','.join(log_header) + '\n')
+        for i in range(n_rows):
+            t = float(i) / sample_rate
+            date = start_date + timedelta(seconds=t)
+            log_file.write('{}{:03d}-0400,{:.1f},{:d},{:d},{:d},{:.1f},{:.2f}\n'.format(
+                date.strftime('%Y-%m-%dT%H:%M:%S.'), date.microsecond // 1000,
+                9.0 + 8.0 * math.sin(t / 20.0),                 # speed in mph
+                int(100 - 60.0 * i / max(n_rows, 1)),           # battery charge
+                int(1800 + 150 * math.sin(t / 3.0)),            # roll, in tenths of degree offset by 180
+                int(1800 + 80 * math.sin(t / 5.0)),             # pitch, in tenths of degree offset by 180
+                int(100 + 20 * math.sin(t / 60.0)),             # motor temperature in Fahrenheit
+                t * 9.0 / 3600.0))                              # odometer in miles
+
+
+def generate_footage(path, seconds, width=1920, height=1080, fps=60):
+    """
+    Synthesizes landscape test footage with sound using ffmpeg's testsrc
+    """
+    from moviepy.config import get_setting
+    subprocess.check_call([get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+                           '-f', 'lavfi', '-i', 'testsrc=size={}x{}:rate={}'.format(width, height, fps),
+                           '-f', 'lavfi', '-i', 'sine=frequency=440',
+                           '-t', str(seconds), '-c:v', 'libx264', '-preset', 'ultrafast', '-pix_fmt', 'yuv420p',
+                           '-c:a', 'aac', path])
+
+
+def time_cli_startup(repeat=3):
+    """
+    Returns the fastest of repeat runs of OnewheelHudVideo.py -h in a fresh interpreter, in seconds
+    """
+    with open(os.devnull, 'w') as devnull:
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            subprocess.check_call([sys.executable, 'OnewheelHudVideo.py', '-h'], stdout=devnull)
+            times.append(time.time() - start)
+    return min(times)
+
+
+def current_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='onewheel-bench-')
+    log_path = os.path.join(work_dir, 'ride.csv')
+    footage_path = os.path.join(work_dir, 'footage.MP4')
+    out_path = os.path.join(work_dir, 'onewheel.MP4')
+    start_date = datetime(2018, 7, 14, 15, 3, 0)
+    log_seconds = args.log_seconds or args.seconds + 10
+
+    print 'Synthesizing log and footage in', work_dir
+    generate_log(log_path, start_date - timedelta(seconds=5), log_seconds, args.sample_rate)
+    generate_footage(footage_path, args.seconds + 1)
+
+    startup = time_cli_startup()
+    if startup > startup_budget:
+        print 'Warning: OnewheelHudVideo.py -h took {:.2f}s to start, over the {:.2f}s budget'.format(startup,
+                                                                                                   startup_budget)
+
+    # the render modules are imported here so that their import time is measured as a stage of its own
+    timer = Instrumentation()
+    with timer.stage('import'):
+        from IconAtlas import IconAtlas
+        from IconManager import IconManager
+        import LogParser
+        import OnewheelHudVideo as hud
+
+    with timer.stage('parse'):
+        LogParser.parse_columns(log_path, 'im', use_cache=False)
+
+    video = hud.OnewheelHudVideo(log_path, footage_path, orientation=args.orientation, resolution=args.resolution,
+                                 start_date=start_date, end_second=args.seconds, unit='im', out_path=out_path,
+                                 hud_renderer=args.hud_renderer, glyph_cache_dir=None, fast_decode=args.fast_decode)
+
+    with timer.stage('interpolation'):
+        telemetry = video.resample_data(hud.render_fps, args.seconds, start_date)
+
+    with timer.stage('icon_warmup'):
+        icon_manager = IconManager(resolution=video.icon_manager_kwargs['resolution'],
+                                   unit=video.icon_manager_kwargs['unit'])
+        atlas = IconAtlas(icon_manager)
+        row = telemetry.row(0)
+        for metric, column in [('speed', 'speed'), ('pitch', 'pitch'), ('roll', 'roll'), ('battery', 'battery'),
+                               ('temperature', 'motor_temp')]:
+            atlas.get(metric, row[column])
+
+    with timer.stage('info_clip'):
+        footage_clip = video.generate_footage_clip()
+        info_clip = video.generate_hud_clip(footage_clip)
+
+    frame_times = [float(i) / hud.render_fps for i in range(telemetry.n_frames)]
+    with timer.stage('hud_frames'):
+        for t in frame_times:
+            info_clip.get_frame(t)
+
+    with timer.stage('compositing'):
+        final_clip = video.composite_clips(footage_clip, info_clip)
+        for t in frame_times:
+            final_clip.get_frame(t)
+
+    if not args.skip_encode:
+        with timer.stage('encode'):
+            final_clip.write_videofile(out_path, fps=hud.render_fps, threads=8)
+
+    frames_per_second = {}
+    for name in ['hud_frames', 'compositing', 'encode']:
+        if name in timer.stages:
+            frames_per_second[name] = telemetry.n_frames / max(timer.stages[name]['seconds'], 1e-9)
+
+    return OrderedDict([
+        ('commit', current_commit()),
+        ('date', datetime.now().isoformat()),
+        ('config', vars(args)),
+        ('frames', telemetry.n_frames),
+        ('cli_startup_seconds', startup),
+        ('stages', timer.stages),
+        ('frames_per_second', frames_per_second),
+        ('peak_rss_mb', peak_rss_mb())
+    ])
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Times every stage of a render of synthetic footage and log')
+    parser.add_argument('--seconds', type=float, default=30, help='Length of the rendered clip in seconds')
+    parser.add_argument('--log-seconds', type=float, default=None,
+                        help='Length of the synthetic log in seconds. Defaults to 10 seconds longer than the clip.')
+    parser.add_argument('--sample-rate', type=float, default=10, help='Rows per second of the synthetic log')
+    parser.add_argument('--resolution', type=str, default='1080', choices=['1080', '720'],
+                        help='Resolution of the synthetic footage and of the render')
+    parser.add_argument('--orientation', type=str, default='portrait', choices=['portrait', 'landscape'],
+                        help='Orientation of the synthetic footage, which decides where the HUD is laid')
+    parser.add_argument('--hud-renderer', type=str, default='stream', choices=['stream', 'clips'],
+                        help='How the HUD is generated, as in OnewheelHudVideo.py')
+    parser.add_argument('--fast-decode', action='store_true',
+                        help='Reads the synthetic footage through an ffmpeg pipe that seeks, scales and rotates it')
+    parser.add_argument('--skip-encode', action='store_true', help='Stops before writing the video file')
+    parser.add_argument('--work-dir', type=str, default=None,
+                        help='Where the synthetic files and the render are written. Defaults to a new temporary '
+                             'directory.')
+    parser.add_argument('--output', '-o', type=str, default='benchmark.json', help='Path of the JSON results')
+    args = parser.parse_args()
+
+    results = run(args)
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print json.dumps(results['stages'], indent=2)
+    print 'Results written to', args.output
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Blending microbenchmark. Times HudBlender laying a synthetic HUD over synthetic footage at every resolution and
+orientation, with the HUD unchanged between frames and with it changing on every frame, against a float blend of the
+whole frame like the one a generic compositor does.
+Like the main script, it must be run from the directory it is in.
+"""
+from collections import OrderedDict
+import json
+import time
+import numpy as np
+from Blend import HudBlender, hud_region
+from OnewheelHudVideo import compute_resolutions
+
+# number of icons laid side by side in the HUD
+n_icons = 5
+
+
+def synthetic_frames(resolution, orientation):
+    """
+    Returns a random RGB footage frame and a random RGBA HUD of the sizes compute_resolutions gives, a quarter of the
+    HUD being fully transparent and a quarter fully opaque like real icons
+    """
+    resolutions = compute_resolutions(orientation, resolution)
+    footage = resolutions['footage']
+    tile = int(resolutions['icon']['w'])
+    hud_shape = (tile, tile * n_icons) if orientation == 'portrait' else (tile * n_icons, tile)
+    random = np.random.RandomState(0)
+    frame = random.randint(0, 256, (footage['h'], footage['w'], 3)).astype(np.uint8)
+    hud = random.randint(0, 256, hud_shape + (4,)).astype(np.uint8)
+    alpha = hud[:, :, 3]
+    alpha[alpha < 64] = 0
+    alpha[alpha >= 192] = 255
+    return frame, hud
+
+
+def naive_blend(frame, hud, orientation):
+    """
+    Pastes the HUD into a transparent canvas the size of the frame and blends the whole frame in floating point
+    """
+    canvas = np.zeros(frame.shape[:2] + (4,), dtype=np.uint8)
+    canvas[hud_region(frame.shape, hud.shape, orientation)] = hud
+    alpha = canvas[:, :, 3:] / 255.0
+    frame[:] = canvas[:, :, :3] * alpha + frame * (1 - alpha) + 0.5
+    return frame
+
+
+def time_per_frame(blend, n_frames):
+    start = time.time()
+    for i in range(n_frames):
+        blend(i)
+    return (time.time() - start) / n_frames
+
+
+def run(n_frames):
+    results = []
+    for resolution in ['720', '1080']:
+        for orientation in ['portrait', 'landscape']:
+            frame, hud = synthetic_frames(resolution, orientation)
+            blender = HudBlender(frame.shape, hud.shape, orientation)
+            results.append(OrderedDict([
+                ('resolution', resolution),
+                ('orientation', orientation),
+                ('hud_unchanged_ms', 1000 * time_per_frame(lambda i: blender.blend(frame, hud, 0), n_frames)),
+                ('hud_changing_ms', 1000 * time_per_frame(lambda i: blender.blend(frame, hud, i + 1), n_frames)),
+                ('naive_float_ms', 1000 * time_per_frame(lambda i: naive_blend(frame, hud, orientation), n_frames))
+            ]))
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Times the blending of the HUD over footage frames')
+    parser.add_argument('--frames', type=int, default=200, help='Frames blended per measurement')
+    parser.add_argument('--output', '-o', type=str, default=None, help='Path of the JSON results, if any')
+    args = parser.parse_args()
+
+    results = run(args.frames)
+    print '{:>10} {:>10} {:>16} {:>16} {:>16}'.format('resolution', 'layout', 'unchanged (ms)', 'changing (ms)',
+                                                     'naive (ms)')
+    for row in results:
+        print '{:>10} {:>10} {:>16.3f} {:>16.3f} {:>16.3f}'.format(row['resolution'], row['orientation'],
+                                                                   row['hud_unchanged_ms'], row['hud_changing_ms'],
+                                                                   row['naive_float_ms'])
+    if args.output:
+        with open(args.output, 'w') as results_file:
+            json.dump(results, results_file, indent=2)
+        print 'Results written to', args.output